@@ -0,0 +1,247 @@
+import bisect
+import collections
+import json
+import re
+
+
+'''
+Proposes source_joint -> target_control pairs from the names and hierarchies of a skeleton
+and a rig. Nothing in this module imports Maya, auto_mapping in retargeting_main feeds it the
+long paths of the scene nodes.
+
+Every name is split into tokens (camelCase, underscores and digits), its side tag (Left, _L,
+r_...) and its noise tokens (FK, Ctrl, Jnt...) are set aside, and what is left is joined into
+a core name that a rule set can alias to a common vocabulary: Mixamo's "UpLeg" and
+AdvancedSkeleton's "Hip" both become one core. Nodes are bucketed by (core, side), so a
+source is only compared with the few targets of its bucket, and with the targets sharing a
+rare token when its bucket is empty. Chains such as Spine, Spine1, Spine2 are matched by
+their position along the chain.
+
+A rule set is a JSON dict, saved per rig family, every key optional. Aliases rename core names
+or tokens on both sides, source_aliases and target_aliases on one side only:
+
+    {
+        "aliases": {"spine": "spine"},
+        "target_aliases": {"hip": "upleg", "elbow": "forearm"},
+        "noise": ["fk"],
+        "pairs": {"Hips": "RootX_M"},
+        "move_able": ["Hips"]
+    }
+
+AdvancedSkeleton_rules.json maps Mixamo skeletons onto AdvancedSkeleton FK controls.
+'''
+
+DEFAULT_RULES = {
+    'aliases': {},
+    'source_aliases': {},
+    'target_aliases': {},
+    'noise': ['fk', 'ctrl', 'ctl', 'con', 'control', 'anim', 'jnt', 'jt', 'joint', 'bind', 'bn', 'drv', 'skin'],
+    'sides': {
+        'L': ['l', 'lf', 'lft', 'left'],
+        'R': ['r', 'rt', 'rgt', 'right'],
+        'M': ['m', 'c', 'ct', 'mid', 'middle', 'center', 'centre'],
+    },
+    'pairs': {},
+    'move_able': [],
+}
+
+_TOKEN_PATTERN = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+
+# Targets of a token shared by more nodes than this are not compared on that token.
+_COMMON_TOKEN = 32
+
+# Targets compared on each side of a source's position along a chain.
+_CHAIN_NEIGHBOURS = 2
+
+
+def load_rules(path):
+    '''
+    Reads a rule set JSON and merges it over DEFAULT_RULES.
+    '''
+    with open(path, "r") as file:
+        return merge_rules(json.load(file))
+
+
+def save_rules(path, rules):
+    with open(path, "w") as file:
+        json.dump(rules, file, indent=4)
+
+
+def merge_rules(rules=None):
+    '''
+    Merges a rule set over DEFAULT_RULES: aliases, pairs and sides are updated, noise and
+    move_able lists are joined. The one-sided aliases are resolved into 'source' and
+    'target' alias dicts.
+    '''
+    rules = rules or {}
+    aliases = {}
+    for key in ('aliases', 'source_aliases', 'target_aliases'):
+        aliases[key] = {name.lower(): alias.lower()
+                        for name, alias in dict(DEFAULT_RULES[key], **rules.get(key, {})).items()}
+    merged = {
+        'source': dict(aliases['aliases'], **aliases['source_aliases']),
+        'target': dict(aliases['aliases'], **aliases['target_aliases']),
+        'noise': set(DEFAULT_RULES['noise']) | {token.lower() for token in rules.get('noise', [])},
+        'sides': {},
+        'pairs': dict(rules.get('pairs', {})),
+        'move_able': set(rules.get('move_able', [])),
+    }
+    for side, tags in dict(DEFAULT_RULES['sides'], **rules.get('sides', {})).items():
+        for tag in tags:
+            merged['sides'][tag.lower()] = side
+    return merged
+
+
+def tokenize(name):
+    '''
+    Splits a node name without namespace into lower case tokens.
+    '''
+    return [token.lower() for token in _TOKEN_PATTERN.findall(name.rsplit(':', 1)[-1])]
+
+
+def describe(name, rules, aliases=None):
+    '''
+    Returns (core, side, index, tokens) of a name: the aliased core name, the side tag ('L',
+    'R' or 'M', the middle for untagged names), the chain number or None, and the aliased
+    tokens left after removing the side and noise tokens.
+
+    Args:
+        dict aliases: {name: alias} for core names and tokens, rules['source'] or
+                      rules['target'].
+    '''
+    aliases = aliases or {}
+    tokens = tokenize(name)
+    side = 'M'
+    for position in (0, -1):
+        if len(tokens) > 1 and tokens[position] in rules['sides']:
+            side = rules['sides'][tokens.pop(position)]
+            break
+    tokens = [token for token in tokens if token not in rules['noise']] or tokens
+    words = [token for token in tokens if not token.isdigit()]
+    digits = [token for token in tokens if token.isdigit()]
+    core = ''.join(words)
+    core = aliases.get(core, core)
+    index = int(digits[-1]) if digits else None
+    return core, side, index, [aliases.get(word, word) for word in words]
+
+
+class _Node(object):
+    def __init__(self, path, depth, rules, aliases):
+        self.path = path
+        self.name = path.split('|')[-1]
+        self.depth = depth
+        self.core, self.side, self.index, self.tokens = describe(self.name, rules, aliases)
+        self.chain = 0.0
+
+
+def _nodes(paths, rules, aliases):
+    '''
+    Builds a _Node per path, its depth counting only the ancestors among paths.
+    '''
+    included = set(paths)
+    nodes = []
+    for path in paths:
+        parts = path.split('|')
+        depth = sum(1 for end in range(1, len(parts)) if '|'.join(parts[:end]) in included)
+        nodes.append(_Node(path, depth, rules, aliases))
+    return nodes
+
+
+def _set_chain_positions(nodes):
+    '''
+    Sets the position of every node along the chain of its (core, side) bucket, from 0 at
+    the root end to 1 at the tip.
+    '''
+    buckets = collections.defaultdict(list)
+    for node in nodes:
+        buckets[(node.core, node.side)].append(node)
+    for bucket in buckets.values():
+        bucket.sort(key=lambda node: (node.depth, -1 if node.index is None else node.index, node.name))
+        for position, node in enumerate(bucket):
+            node.chain = position / (len(bucket) - 1) if len(bucket) > 1 else 0.0
+    return buckets
+
+
+def _depth_factor(source, target, max_depth):
+    return 1.0 - 0.25 * abs(source.depth - target.depth) / max_depth
+
+
+def auto_map(source_paths, target_paths, rules=None, min_confidence=0.3):
+    '''
+    Pairs source joints with target controls.
+
+    Args:
+        list source_paths: Long paths of the source joints, without namespaces.
+        list target_paths: Long paths of the target controls, without namespaces.
+        dict rules: A rule set from load_rules or merge_rules, DEFAULT_RULES when None.
+        float min_confidence: Pairs scoring below this are dropped.
+
+    Return:
+        mappings: One dict per pair, {'source_joint', 'target_control', 'move_able',
+                  'confidence'}, sorted by source path so parents come before their
+                  children. Every source and target is used at most once.
+    '''
+    rules = rules or merge_rules()
+    sources = _nodes(source_paths, rules, rules['source'])
+    targets = _nodes(target_paths, rules, rules['target'])
+    _set_chain_positions(sources)
+    target_buckets = _set_chain_positions(targets)
+    chain_positions = {key: [target.chain for target in bucket] for key, bucket in target_buckets.items()}
+    max_depth = max([node.depth for node in sources + targets] + [1])
+
+    token_index = collections.defaultdict(list)
+    for target in targets:
+        for token in set(target.tokens):
+            token_index[(token, target.side)].append(target)
+
+    candidates = []
+    targets_by_name = {target.name: target for target in targets}
+    for source in sources:
+        if source.name in rules['pairs'] and rules['pairs'][source.name] in targets_by_name:
+            candidates.append((2.0, source, targets_by_name[rules['pairs'][source.name]]))
+            continue
+
+        key = (source.core, source.side)
+        bucket = target_buckets.get(key, [])
+        # Buckets are sorted along their chain, only the targets near the source's position compete.
+        position = bisect.bisect_left(chain_positions.get(key, []), source.chain)
+        for target in bucket[max(0, position - _CHAIN_NEIGHBOURS):position + _CHAIN_NEIGHBOURS]:
+            score = (1.0 - 0.5 * abs(source.chain - target.chain)) * _depth_factor(source, target, max_depth)
+            candidates.append((score, source, target))
+        if bucket:
+            continue
+
+        shared = set()
+        for token in set(source.tokens):
+            matches = token_index.get((token, source.side), [])
+            if len(matches) <= _COMMON_TOKEN:
+                shared.update(matches)
+        for target in shared:
+            overlap = len(set(source.tokens) & set(target.tokens)) / len(set(source.tokens) | set(target.tokens))
+            candidates.append((0.7 * overlap * _depth_factor(source, target, max_depth), source, target))
+
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1].path, candidate[2].path))
+    pairs = {}
+    used_targets = set()
+    for score, source, target in candidates:
+        if score < min_confidence or source.path in pairs or target.path in used_targets:
+            continue
+        pairs[source.path] = (min(score, 1.0), target)
+        used_targets.add(target.path)
+
+    mapped = [source for source in sources if source.path in pairs]
+    root_depth = min([source.depth for source in mapped] + [0])
+    mappings = []
+    for source in sorted(mapped, key=lambda source: source.path):
+        confidence, target = pairs[source.path]
+        if rules['move_able']:
+            move_able = source.name in rules['move_able']
+        else:
+            move_able = source.depth == root_depth
+        mappings.append({
+            'source_joint': source.name,
+            'target_control': target.name,
+            'move_able': move_able,
+            'confidence': round(confidence, 3),
+        })
+    return mappings
@@ -0,0 +1,315 @@
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+
+'''
+Headless batch retargeting. Run it with mayapy:
+
+    mayapy retargeting_batch.py Fight_config.json rig.ma takes/ --output-dir baked/ --workers 4
+
+Every source clip is opened against the target rig in a pool of Maya standalone worker
+processes, retargeted with apply_retargeting and saved as its own file. A JSON summary with
+the timing and failure of every clip is written next to the outputs.
+
+With --shards N a long clip is split into N contiguous frame ranges baked by different
+workers. The raw shard results are merged in time order, and one last worker Euler-filters
+the merged bake and writes the keys, so the result matches a serial run.
+
+Maya is only imported inside the worker processes, so the orchestration can run with a stub
+worker where Maya is not installed.
+'''
+
+CLIP_EXTENSIONS = ('.ma', '.mb', '.fbx')
+
+BAKE_OPTIONS = ('neutral_frame', 'solver', 'sampling', 'frame_range', 'sample_step', 'cache_offsets',
+                'offset_cache_file')
+
+
+def find_clips(sources):
+    '''
+    Lists the source clips of a directory or a manifest.
+
+    Args:
+        str sources: A directory holding clips, a text manifest with one path per line, or
+                     a JSON manifest holding a list of paths. Relative manifest paths are
+                     resolved from the manifest's folder.
+
+    Return:
+        clips: Sorted list of clip paths for a directory, manifest order otherwise.
+    '''
+    if os.path.isdir(sources):
+        return sorted(os.path.join(sources, name) for name in os.listdir(sources)
+                      if name.lower().endswith(CLIP_EXTENSIONS))
+
+    with open(sources, "r") as file:
+        if sources.lower().endswith('.json'):
+            clips = json.load(file)
+        else:
+            clips = [line.strip() for line in file if line.strip() and not line.startswith('#')]
+    root = os.path.dirname(os.path.abspath(sources))
+    return [clip if os.path.isabs(clip) else os.path.join(root, clip) for clip in clips]
+
+
+def build_jobs(clips, mapping_file, rig_file, output_dir, options=None, extension='.ma', shards=1):
+    '''
+    Builds one job per clip. options are passed through to apply_retargeting, and shards
+    above 1 bake each clip in that many frame ranges.
+    '''
+    jobs = []
+    for clip in clips:
+        name = os.path.splitext(os.path.basename(clip))[0]
+        jobs.append({
+            'clip': clip,
+            'mapping': mapping_file,
+            'rig': rig_file,
+            'output': os.path.join(output_dir, f'{name}{extension}'),
+            'options': dict(options or {}),
+            'shards': shards,
+        })
+    return jobs
+
+
+def initialize_maya():
+    '''
+    Starts Maya standalone once in every worker process.
+    '''
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+
+
+def _open_clip(job):
+    '''
+    Opens the rig scene and imports the job's source clip into it.
+    '''
+    import maya.cmds as cmds
+
+    source_namespace = job['options'].get('source_namespace', '')
+    cmds.file(new=True, force=True)
+    cmds.file(job['rig'], open=True, force=True)
+
+    import_flags = {'i': True}
+    if job['clip'].lower().endswith('.fbx'):
+        cmds.loadPlugin('fbxmaya', quiet=True)
+        import_flags['type'] = 'FBX'
+    if source_namespace:
+        import_flags['namespace'] = source_namespace
+    cmds.file(job['clip'], **import_flags)
+
+
+def _save_output(job):
+    import maya.cmds as cmds
+
+    cmds.file(rename=job['output'])
+    file_type = 'mayaBinary' if job['output'].lower().endswith('.mb') else 'mayaAscii'
+    cmds.file(save=True, force=True, type=file_type)
+    return job['output']
+
+
+def retarget_clip(job):
+    '''
+    Worker: opens the rig, imports the clip, runs apply_retargeting and saves the result.
+    '''
+    import retargeting_main as retarget
+
+    _open_clip(job)
+    options = dict(job['options'])
+    retarget.apply_retargeting(options.pop('target_namespace', ''), options.pop('source_namespace', ''),
+                               config_file=job['mapping'], **options)
+    return _save_output(job)
+
+
+def bake_shard(job):
+    '''
+    Worker: bakes the raw values of one frame range of a clip, job['shard'] is (index, count).
+    '''
+    import retargeting_main as retarget
+
+    _open_clip(job)
+    options = job['options']
+    bake_options = {key: value for key, value in options.items() if key in BAKE_OPTIONS}
+    return retarget.bake_retargeting(options.get('target_namespace', ''), options.get('source_namespace', ''),
+                                     config_file=job['mapping'], shard=job['shard'], **bake_options)
+
+
+def write_merged(job):
+    '''
+    Worker: filters and keys a merged bake, job['buffer'], onto the rig and saves the result.
+    '''
+    import retargeting_main as retarget
+
+    _open_clip(job)
+    options = {key: value for key, value in job['options'].items() if key not in BAKE_OPTIONS}
+    retarget.apply_retargeting(options.pop('target_namespace', ''), options.pop('source_namespace', ''),
+                               config_file=job['mapping'], buffer=job['buffer'], **options)
+    return _save_output(job)
+
+
+def _run_job(worker, job):
+    '''
+    Runs a worker on one job and turns its outcome into a summary entry.
+    '''
+    start = time.perf_counter()
+    entry = {'clip': job['clip'], 'output': job['output']}
+    try:
+        entry['result'] = worker(job)
+        entry['status'] = 'ok'
+    except Exception as e:
+        entry['status'] = 'failed'
+        entry['error'] = f'{type(e).__name__}: {e}'
+        entry['traceback'] = traceback.format_exc()
+    entry['seconds'] = time.perf_counter() - start
+    return entry
+
+
+def _collect(job, future):
+    try:
+        return future.result()
+    except Exception as e:
+        # The worker process itself died, the job never reported back.
+        return {'clip': job['clip'], 'output': job['output'], 'status': 'failed',
+                'error': f'{type(e).__name__}: {e}', 'seconds': 0.0}
+
+
+def _merge_shards(job, shard_entries, pool, merge_worker):
+    '''
+    Merges the shard bakes of one clip and runs the write worker on the result.
+    '''
+    failed = [entry for entry in shard_entries if entry['status'] != 'ok']
+    if failed:
+        entry = dict(failed[0], seconds=0.0)
+    else:
+        import retargeting_math as retarget_math
+        try:
+            merged = retarget_math.merge_buffers([entry['result'] for entry in shard_entries])
+        except ValueError as e:
+            entry = {'clip': job['clip'], 'output': job['output'], 'status': 'failed',
+                     'error': f'{type(e).__name__}: {e}', 'seconds': 0.0}
+        else:
+            entry = _collect(job, pool.submit(_run_job, merge_worker, dict(job, buffer=merged)))
+
+    shard_seconds = [shard_entry['seconds'] for shard_entry in shard_entries]
+    entry['shard_seconds'] = shard_seconds
+    entry['seconds'] = entry['seconds'] + sum(shard_seconds)
+    return entry
+
+
+def run_batch(jobs, worker=retarget_clip, workers=None, initializer=initialize_maya,
+              shard_worker=bake_shard, merge_worker=write_merged):
+    '''
+    Runs every job in a pool of worker processes.
+
+    Args:
+        list jobs: Jobs from build_jobs.
+        callable worker: Picklable function taking one job, retarget_clip by default.
+        int workers: Process count, the CPU count when None.
+        callable initializer: Run once in every process before its first job.
+        callable shard_worker: Bakes one frame range of a sharded job and returns its BakeBuffer.
+        callable merge_worker: Writes the merged BakeBuffer of a sharded job, job['buffer'].
+
+    Return:
+        summary: {'seconds', 'workers', 'succeeded', 'failed', 'jobs': [entry per job]}.
+                 Entries keep the order of the jobs. Sharded jobs add 'shard_seconds'.
+    '''
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                initializer=initializer) as pool:
+        submitted = []
+        for job in jobs:
+            shards = job.get('shards', 1)
+            if shards > 1:
+                futures = [pool.submit(_run_job, shard_worker, dict(job, shard=(index, shards)))
+                           for index in range(shards)]
+            else:
+                futures = [pool.submit(_run_job, worker, job)]
+            submitted.append((job, futures))
+
+        entries = []
+        for job, futures in submitted:
+            results = [_collect(job, future) for future in futures]
+            if job.get('shards', 1) > 1:
+                entries.append(_merge_shards(job, results, pool, merge_worker))
+            else:
+                entries.append(results[0])
+            entries[-1].pop('result', None)
+
+    failed = [entry for entry in entries if entry['status'] != 'ok']
+    return {
+        'seconds': time.perf_counter() - start,
+        'workers': workers,
+        'succeeded': len(entries) - len(failed),
+        'failed': len(failed),
+        'jobs': entries,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Retarget a batch of mocap clips onto a rig with mayapy.')
+    parser.add_argument('mapping', help='Mapping JSON, such as Fight_config.json.')
+    parser.add_argument('rig', help='Target rig scene.')
+    parser.add_argument('sources', help='Directory of source clips, or a .txt/.json manifest of clip paths.')
+    parser.add_argument('--output-dir', default='retargeted', help='Folder for the retargeted scenes.')
+    parser.add_argument('--format', choices=['ma', 'mb'], default='ma', help='Output scene format.')
+    parser.add_argument('--summary', help='Summary JSON path, <output-dir>/summary.json by default.')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, the CPU count by default.')
+    parser.add_argument('--shards', type=int, default=1, help='Frame ranges each clip is split into.')
+    parser.add_argument('--target-namespace', default='')
+    parser.add_argument('--source-namespace', default='')
+    parser.add_argument('--neutral-frame', type=float, default=-1)
+    parser.add_argument('--solver', choices=['constraint', 'offline'], default='constraint')
+    parser.add_argument('--sampling', choices=['keys', 'range', 'step', 'subframes'], default='keys')
+    parser.add_argument('--sample-step', type=float, default=1.0)
+    parser.add_argument('--reduce-keys', action='store_true')
+    parser.add_argument('--window', type=int, default=None,
+                        help='Bake and key this many frames at a time, bounding memory on long clips.')
+    parser.add_argument('--offset-cache', help='Bind offset cache JSON shared by every clip of the rig pair.')
+    parser.add_argument('--rebind', action='store_true',
+                        help='Clear the bind offset cache before the batch, needs --offset-cache.')
+    args = parser.parse_args(argv)
+    if args.rebind and not args.offset_cache:
+        parser.error('--rebind needs --offset-cache')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    clips = find_clips(args.sources)
+    os.makedirs(args.output_dir, exist_ok=True)
+    options = {
+        'target_namespace': args.target_namespace,
+        'source_namespace': args.source_namespace,
+        'neutral_frame': args.neutral_frame,
+        'solver': args.solver,
+        'sampling': args.sampling,
+        'sample_step': args.sample_step,
+        'reduce_keys': args.reduce_keys,
+        'window': args.window,
+    }
+    if args.offset_cache:
+        options.update({'cache_offsets': True, 'offset_cache_file': os.path.abspath(args.offset_cache)})
+        if args.rebind and os.path.exists(args.offset_cache):
+            os.remove(args.offset_cache)
+    jobs = build_jobs(clips, os.path.abspath(args.mapping), os.path.abspath(args.rig),
+                      os.path.abspath(args.output_dir), options, f'.{args.format}', args.shards)
+
+    summary = run_batch(jobs, workers=args.workers)
+    summary.update({'mapping': args.mapping, 'rig': args.rig})
+
+    summary_path = args.summary or os.path.join(args.output_dir, 'summary.json')
+    with open(summary_path, "w") as file:
+        json.dump(summary, file, indent=4)
+
+    print(f"{summary['succeeded']} of {len(jobs)} clips retargeted in {summary['seconds']:.1f}s, "
+          f"summary written to {summary_path}")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,845 @@
+import argparse
+import collections
+import itertools
+import json
+import os
+import sys
+import time
+import types
+
+import numpy as np
+
+
+'''
+Retarget benchmarks without Maya.
+
+A small in-process stand-in for maya.cmds and maya.api.OpenMaya simulates a joint hierarchy,
+animCurves, orient/point constraints and time changes, and counts every command and API
+call. apply_retargeting runs against it for every scenario of mapping size x clip length x
+key density, with Fight_config.json as the baseline mapping.
+
+    python retargeting_bench.py --output bench_new.json
+    python retargeting_bench.py --compare bench_old.json bench_new.json
+
+The fake is only meant to measure the Python side of the pipeline and how many scene calls
+it makes, it does not reproduce Maya's evaluation cost or its exact constraint math.
+'''
+
+# Keeps the Qt application made by load_mapping_model alive.
+_QT_APPLICATION = None
+
+BASELINE_MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Fight_config.json')
+
+ANGLE_ATTRS = {'rx': 'rotateX', 'ry': 'rotateY', 'rz': 'rotateZ'}
+DISTANCE_ATTRS = {'tx': 'translateX', 'ty': 'translateY', 'tz': 'translateZ'}
+VECTOR_ATTRS = {
+    'translate': ('tx', 'ty', 'tz'),
+    'rotate': ('rx', 'ry', 'rz'),
+    'scale': ('sx', 'sy', 'sz'),
+    'rotateAxis': ('rax', 'ray', 'raz'),
+    'jointOrient': ('jox', 'joy', 'joz'),
+    'rotatePivot': ('rpx', 'rpy', 'rpz'),
+    'rotatePivotTranslate': ('rptx', 'rpty', 'rptz'),
+}
+MATRIX_ATTRS = ('worldMatrix', 'parentMatrix')
+_LONG_TO_SHORT = {long_name: short for short, long_name in
+                  itertools.chain(ANGLE_ATTRS.items(), DISTANCE_ATTRS.items())}
+
+
+class FakeCurve(object):
+    def __init__(self, name, times=(), values=()):
+        self.name = name
+        self.times = np.asarray(times, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.tangent_type = 'auto'
+        self.pre_infinity = 0
+        self.post_infinity = 0
+        self.weighted = False
+
+    def evaluate(self, time):
+        return float(np.interp(time, self.times, self.values)) if len(self.times) else 0.0
+
+
+class FakeConstraint(object):
+    def __init__(self, name, kind, source, target, offset):
+        self.name = name
+        self.kind = kind
+        self.source = source
+        self.target = target
+        self.offset = offset
+
+
+class FakeScene(object):
+    '''
+    Nodes, connections and time of the simulated scene, plus a counter of every call.
+    '''
+    def __init__(self):
+        self.nodes = {}
+        self.curves = {}
+        self.constraints = {}
+        self.connections = {}
+        self.calls = collections.Counter()
+        self.time = 0.0
+        self.context_time = None
+        self.playback = (0.0, 100.0)
+        self.auto_key = True
+        self.evaluation = 'parallel'
+
+    def add_node(self, name, node_type='transform', parent=None, **attrs):
+        values = {'rotateOrder': 0}
+        for short_names in VECTOR_ATTRS.values():
+            values.update({short: 0.0 for short in short_names})
+        values.update({'sx': 1.0, 'sy': 1.0, 'sz': 1.0})
+        values.update(attrs)
+        self.nodes[name] = {'type': node_type, 'parent': parent, 'attrs': values, 'locked': set(),
+                            'nonkeyable': set()}
+
+    def add_curve(self, plug, times, values):
+        name = self.unique_name(plug.replace('.', '_'))
+        self.curves[name] = FakeCurve(name, times, values)
+        self.connections[plug] = name
+        return name
+
+    def unique_name(self, name):
+        candidate = name
+        for index in itertools.count(1):
+            if candidate not in self.nodes and candidate not in self.curves and candidate not in self.constraints:
+                return candidate
+            candidate = f'{name}{index}'
+
+    def long_name(self, node):
+        path = []
+        while node is not None:
+            path.append(node)
+            node = self.nodes[node]['parent']
+        return '|' + '|'.join(reversed(path))
+
+    def resolve(self, name):
+        return name.split('|')[-1]
+
+    def evaluation_time(self):
+        return self.time if self.context_time is None else self.context_time
+
+    def value(self, node, attr, time=None):
+        '''
+        Value of a scalar channel in UI units, following curves and constraints.
+        '''
+        time = self.evaluation_time() if time is None else time
+        attr = _LONG_TO_SHORT.get(attr, attr)
+        driver = self.connections.get(f'{node}.{attr}')
+        if driver in self.curves:
+            return self.curves[driver].evaluate(time)
+        if driver in self.constraints:
+            constraint = self.constraints[driver]
+            source_value = self.value(constraint.source, attr, time)
+            return source_value + constraint.offset.get(attr, 0.0)
+        return self.nodes[node]['attrs'][attr]
+
+    def vector(self, node, attr, time=None):
+        return tuple(self.value(node, short, time) for short in VECTOR_ATTRS[attr])
+
+    def world_matrix(self, node, time=None):
+        import retargeting_math as retarget_math
+
+        order = retarget_math.ROTATE_ORDERS[self.nodes[node]['attrs']['rotateOrder']]
+        rotation = retarget_math.euler_to_matrix(np.array([self.vector(node, 'rotate', time)]), order)
+        rotation = retarget_math.euler_to_matrix(np.array(self.vector(node, 'rotateAxis', time))) @ rotation
+        if self.nodes[node]['type'] == 'joint':
+            rotation = rotation @ retarget_math.euler_to_matrix(np.array(self.vector(node, 'jointOrient', time)))
+        local = retarget_math.compose_matrix(rotation, self.vector(node, 'translate', time),
+                                             self.vector(node, 'scale', time),
+                                             self.vector(node, 'rotatePivot', time),
+                                             self.vector(node, 'rotatePivotTranslate', time))[0]
+        return local @ self.parent_matrix(node, time)
+
+    def parent_matrix(self, node, time=None):
+        parent = self.nodes[node]['parent']
+        return np.identity(4) if parent is None else self.world_matrix(parent, time)
+
+
+def _split_plug(plug):
+    node, attr = plug.split('.', 1)
+    return node.split('|')[-1], attr.split('[')[0]
+
+
+class FakeCommands(types.ModuleType):
+    '''
+    The subset of maya.cmds used by the retarget pipeline. Every call is counted in
+    scene.calls under its command name.
+    '''
+    def __init__(self):
+        super(FakeCommands, self).__init__('maya.cmds')
+        self.scene = FakeScene()
+
+    def __getattribute__(self, name):
+        attribute = super(FakeCommands, self).__getattribute__(name)
+        if not name.startswith('_') and name != 'scene' and callable(attribute):
+            super(FakeCommands, self).__getattribute__('scene').calls[f'cmds.{name}'] += 1
+        return attribute
+
+    def currentTime(self, time=None, query=False, **kwargs):
+        if query:
+            return self.scene.time
+        self.scene.time = float(time)
+        self.scene.calls['time_changes'] += 1
+        return self.scene.time
+
+    def playbackOptions(self, query=False, minTime=False, maxTime=False, **kwargs):
+        return self.scene.playback[0] if minTime else self.scene.playback[1]
+
+    def _constraint(self, kind, source, target, attrs, maintain_offset):
+        scene = self.scene
+        source, target = scene.resolve(source), scene.resolve(target)
+        name = scene.unique_name(f'{target}_{kind}1')
+        offset = {}
+        if maintain_offset:
+            offset = {attr: scene.value(target, attr) - scene.value(source, attr) for attr in attrs}
+        scene.constraints[name] = FakeConstraint(name, kind, source, target, offset)
+        for attr in attrs:
+            scene.connections[f'{target}.{attr}'] = name
+        return [name]
+
+    def orientConstraint(self, source, target, mo=False, **kwargs):
+        return self._constraint('orientConstraint', source, target, ('rx', 'ry', 'rz'), mo)
+
+    def pointConstraint(self, source, target, mo=False, **kwargs):
+        return self._constraint('pointConstraint', source, target, ('tx', 'ty', 'tz'), mo)
+
+    def delete(self, nodes):
+        scene = self.scene
+        for node in [nodes] if isinstance(nodes, str) else nodes:
+            scene.constraints.pop(node, None)
+            scene.curves.pop(node, None)
+            scene.nodes.pop(node, None)
+            for plug, driver in list(scene.connections.items()):
+                if driver == node:
+                    del scene.connections[plug]
+
+    def _curves(self, plugs):
+        curves = []
+        for plug in [plugs] if isinstance(plugs, str) else plugs:
+            if plug in self.scene.curves:
+                curves.append(self.scene.curves[plug])
+                continue
+            node, attr = _split_plug(plug)
+            driver = self.scene.connections.get(f'{node}.{_LONG_TO_SHORT.get(attr, attr)}')
+            if driver in self.scene.curves:
+                curves.append(self.scene.curves[driver])
+        return curves
+
+    def keyframe(self, plugs, query=False, timeChange=False, valueChange=False, keyframeCount=False, **kwargs):
+        if keyframeCount:
+            return sum(len(curve.times) for curve in self._curves(plugs))
+        keys = []
+        for curve in self._curves(plugs):
+            if timeChange and valueChange:
+                keys.extend(np.column_stack((curve.times, curve.values)).ravel().tolist())
+            else:
+                keys.extend((curve.values if valueChange else curve.times).tolist())
+        return keys or None
+
+    def keyTangent(self, *args, query=False, inAngle=False, outAngle=False, inWeight=False, outWeight=False,
+                   inTangentType=False, outTangentType=False, **kwargs):
+        if not query:
+            return None
+        if not args:
+            return ['auto']
+        # Multiple query flags are returned interleaved per key, in flag order.
+        values = []
+        for curve in self._curves(args[0]):
+            key = [0.0] * (inAngle + outAngle) + [1.0] * (inWeight + outWeight)
+            key += [curve.tangent_type] * (inTangentType + outTangentType)
+            values.extend(key * len(curve.times))
+        return values or None
+
+    def listConnections(self, plug, type=None, **kwargs):
+        node, attr = _split_plug(plug)
+        driver = self.scene.connections.get(f'{node}.{_LONG_TO_SHORT.get(attr, attr)}')
+        if driver is None or (type == 'animCurve' and driver not in self.scene.curves):
+            return None
+        return [driver]
+
+    def getAttr(self, plug, type=False, time=None, lock=False, **kwargs):
+        scene = self.scene
+        node, attr = _split_plug(plug)
+        short = _LONG_TO_SHORT.get(attr, attr)
+        if type:
+            if short in ANGLE_ATTRS:
+                return 'doubleAngle'
+            if short in DISTANCE_ATTRS:
+                return 'doubleLinear'
+            return 'double3' if attr in VECTOR_ATTRS else 'double'
+        if lock:
+            return short in scene.nodes[node]['locked']
+        if attr in VECTOR_ATTRS:
+            return [scene.vector(node, attr, time)]
+        if attr == 'rotateOrder' or attr not in _LONG_TO_SHORT and not isinstance(scene.nodes[node]['attrs'].get(attr), float):
+            return scene.nodes[node]['attrs'][attr]
+        return scene.value(node, short, time)
+
+    def addAttr(self, node, longName=None, **kwargs):
+        self.scene.nodes[node]['attrs'][longName] = None
+
+    def setAttr(self, plug, *values, **kwargs):
+        scene = self.scene
+        name, attr = plug.split('.', 1)
+        if attr.startswith('ktv'):
+            curve = scene.curves[name]
+            first = int(attr[4:-1].split(':')[0])
+            curve.times = np.concatenate((curve.times[:first], np.asarray(values[0::2], dtype=np.float64)))
+            curve.values = np.concatenate((curve.values[:first], np.asarray(values[1::2], dtype=np.float64)))
+            return
+        node, attr = _split_plug(plug)
+        scene.nodes[node]['attrs'][_LONG_TO_SHORT.get(attr, attr)] = values[0]
+
+    def createNode(self, node_type, name=None, **kwargs):
+        name = self.scene.unique_name(name or node_type)
+        if node_type.startswith('animCurve'):
+            self.scene.curves[name] = FakeCurve(name)
+        else:
+            self.scene.add_node(name, node_type)
+        return name
+
+    def connectAttr(self, source, destination, force=False, **kwargs):
+        node, attr = _split_plug(destination)
+        self.scene.connections[f'{node}.{_LONG_TO_SHORT.get(attr, attr)}'] = source.split('.')[0]
+
+    def isConnected(self, source, destination, **kwargs):
+        node, attr = _split_plug(destination)
+        return self.scene.connections.get(f'{node}.{_LONG_TO_SHORT.get(attr, attr)}') == source.split('.')[0]
+
+    def ls(self, names=None, long=False, **kwargs):
+        scene = self.scene
+        names = [names] if isinstance(names, str) else (names or list(scene.nodes))
+        found = [scene.resolve(name) for name in names if scene.resolve(name) in scene.nodes]
+        return [scene.long_name(name) for name in found] if long else found
+
+    def nodeType(self, name):
+        return self.scene.nodes[self.scene.resolve(name)]['type']
+
+    def objExists(self, name):
+        name = self.scene.resolve(name.split('.')[0])
+        return name in self.scene.nodes or name in self.scene.curves
+
+    def undoInfo(self, query=False, state=False, **kwargs):
+        return True if query else None
+
+    def autoKeyframe(self, query=False, state=False, **kwargs):
+        if query:
+            return self.scene.auto_key
+        self.scene.auto_key = state
+
+    def evaluationManager(self, query=False, mode=None, **kwargs):
+        if query:
+            return [self.scene.evaluation]
+        self.scene.evaluation = mode
+
+    def refresh(self, **kwargs):
+        return None
+
+
+def _build_open_maya(commands):
+    '''
+    The subset of maya.api.OpenMaya used by the retarget pipeline, reading from the
+    FakeCommands scene. Plug reads are counted as api.read.
+    '''
+    om = types.ModuleType('maya.api.OpenMaya')
+
+    class MFn(object):
+        kUnitAttribute = 'unit'
+        kTypedAttribute = 'typed'
+        kAnimCurve = 'animCurve'
+
+    class MFnData(object):
+        kMatrix = 'matrix'
+
+    class MAttribute(object):
+        def __init__(self, kind, unit_type=None):
+            self.kind = kind
+            self.unit_type = unit_type
+
+        def hasFn(self, kind):
+            return self.kind == kind
+
+    class MFnUnitAttribute(object):
+        kAngle = 'angle'
+        kDistance = 'distance'
+
+        def __init__(self, attribute):
+            self.attribute = attribute
+
+        def unitType(self):
+            return self.attribute.unit_type
+
+    class MFnTypedAttribute(object):
+        def __init__(self, attribute):
+            self.attribute = attribute
+
+        def attrType(self):
+            return MFnData.kMatrix
+
+    class MFnMatrixData(object):
+        def __init__(self, data):
+            self.data = data
+
+        def matrix(self):
+            return self.data
+
+    class MPlug(object):
+        def __init__(self, plug):
+            self.node, self.attr = _split_plug(plug)
+            self.short = _LONG_TO_SHORT.get(self.attr, self.attr)
+
+        def attribute(self):
+            if self.attr in MATRIX_ATTRS:
+                return MAttribute(MFn.kTypedAttribute)
+            if self.short in ANGLE_ATTRS:
+                return MAttribute(MFn.kUnitAttribute, MFnUnitAttribute.kAngle)
+            if self.short in DISTANCE_ATTRS:
+                return MAttribute(MFn.kUnitAttribute, MFnUnitAttribute.kDistance)
+            return MAttribute(None)
+
+        def asDouble(self):
+            commands.scene.calls['api.read'] += 1
+            value = commands.scene.value(self.node, self.short)
+            return np.radians(value) if self.short in ANGLE_ATTRS else value
+
+        def asMObject(self):
+            commands.scene.calls['api.read'] += 1
+            scene = commands.scene
+            if self.attr == 'worldMatrix':
+                return scene.world_matrix(self.node).ravel().tolist()
+            return scene.parent_matrix(self.node).ravel().tolist()
+
+        @property
+        def isLocked(self):
+            return self.short in commands.scene.nodes[self.node]['locked']
+
+        @property
+        def isKeyable(self):
+            return self.short not in commands.scene.nodes[self.node]['nonkeyable']
+
+        def source(self):
+            commands.scene.calls['api.source'] += 1
+            return MSource(commands.scene.connections.get(f'{self.node}.{self.short}'))
+
+    class MSource(object):
+        # The plug driving an MPlug, only its node is used.
+        def __init__(self, driver):
+            self.driver = driver
+            self.isNull = driver is None
+
+        def node(self):
+            return MObject(self.driver)
+
+    class MObject(object):
+        def __init__(self, name):
+            self.name = name
+
+        def hasFn(self, kind):
+            return kind == MFn.kAnimCurve and self.name in commands.scene.curves
+
+    class MFnAnimCurve(object):
+        def __init__(self, node):
+            self.curve = commands.scene.curves[node.name]
+            self.numKeys = len(self.curve.times)
+
+        def input(self, index):
+            return MTime(float(self.curve.times[index]))
+
+        def value(self, index):
+            return float(self.curve.values[index])
+
+        def evaluate(self, time):
+            return self.curve.evaluate(time.value)
+
+        def name(self):
+            return self.curve.name
+
+        @property
+        def preInfinityType(self):
+            return self.curve.pre_infinity
+
+        @property
+        def postInfinityType(self):
+            return self.curve.post_infinity
+
+        @property
+        def isWeighted(self):
+            return self.curve.weighted
+
+    class MSelectionList(object):
+        def __init__(self):
+            self.items = []
+
+        def add(self, name):
+            node = name.split('.')[0].split('|')[-1]
+            if node not in commands.scene.nodes:
+                raise RuntimeError(f'(kInvalidParameter): Object does not exist: {name}')
+            self.items.append(name)
+
+        def getPlug(self, index):
+            return MPlug(self.items[index])
+
+        def getDependNode(self, index):
+            return MObject(self.items[index].split('|')[-1])
+
+    class MFnDependencyNode(object):
+        def __init__(self, node):
+            self.name = node.name
+
+        def hasAttribute(self, attr):
+            return not attr.startswith('jo') or commands.scene.nodes[self.name]['type'] == 'joint'
+
+        def findPlug(self, attr, want_networked):
+            return MPlug(f'{self.name}.{attr}')
+
+    class MAngle(object):
+        kRadians = 'radians'
+        kDegrees = 'degrees'
+
+        def __init__(self, value, unit='radians'):
+            self.radians = value if unit == MAngle.kRadians else np.radians(value)
+
+        @staticmethod
+        def uiUnit():
+            return MAngle.kDegrees
+
+        def asUnits(self, unit):
+            return float(self.radians if unit == MAngle.kRadians else np.degrees(self.radians))
+
+    class MDistance(object):
+        kCentimeters = 'cm'
+
+        def __init__(self, value, unit='cm'):
+            self.value = value
+
+        @staticmethod
+        def uiUnit():
+            return MDistance.kCentimeters
+
+        def asUnits(self, unit):
+            return float(self.value)
+
+    class MTime(object):
+        def __init__(self, value=0.0, unit='film'):
+            self.value = value
+
+        @staticmethod
+        def uiUnit():
+            return 'film'
+
+        def asUnits(self, unit):
+            return self.value
+
+    class MDGContext(object):
+        def __init__(self, time=None):
+            self.time = None if time is None else time.value
+
+        def makeCurrent(self):
+            scene = commands.scene
+            previous = MDGContext()
+            previous.time = scene.context_time
+            scene.context_time = self.time
+            return previous
+
+    for item in (MFn, MFnData, MFnUnitAttribute, MFnTypedAttribute, MFnMatrixData, MSelectionList,
+                 MAngle, MDistance, MTime, MDGContext, MObject, MFnAnimCurve, MFnDependencyNode):
+        setattr(om, item.__name__, item)
+    return om
+
+
+def install_fake_maya():
+    '''
+    Puts the stand-in maya modules in sys.modules and imports retargeting_main against them.
+
+    Return:
+        commands: The FakeCommands module, its scene attribute can be replaced per run.
+        retarget: The retargeting_main module.
+    '''
+    commands = FakeCommands()
+    maya = types.ModuleType('maya')
+    api = types.ModuleType('maya.api')
+    api.OpenMaya = _build_open_maya(commands)
+    maya.cmds = commands
+    maya.api = api
+    sys.modules.update({'maya': maya, 'maya.cmds': commands, 'maya.api': api,
+                        'maya.api.OpenMaya': api.OpenMaya})
+    sys.modules.pop('retargeting_main', None)
+    import retargeting_main as retarget
+    return commands, retarget
+
+
+def scaled_mapping(mapping, scale):
+    '''
+    Repeats a mapping scale times with numbered copies of every name.
+    '''
+    entries = []
+    for copy in range(scale):
+        suffix = '' if copy == 0 else f'_{copy}'
+        for entry in mapping:
+            entries.append(dict(entry, source_joint=entry['source_joint'] + suffix,
+                                target_control=entry['target_control'] + suffix))
+    return entries
+
+
+def character_namespaces(count):
+    '''
+    (source_namespace, target_namespace) pairs of the characters built by build_scene.
+    '''
+    return [(f'mocap{index}', f'rig{index}') for index in range(count)]
+
+
+def build_scene(mapping, frames, key_density, seed=0, characters=1):
+    '''
+    Builds source joints keyed over the clip and matching target controls.
+
+    Every source joint sits under its mapping's first joint (the hips) and every control under
+    the first control, so parent-first solving is exercised. Keys are placed every
+    1 / key_density frames on each channel of the mapping. With more than one character every
+    skeleton and rig is built under the namespaces of character_namespaces.
+    '''
+    rng = np.random.default_rng(seed)
+    scene = FakeScene()
+    scene.playback = (0.0, float(frames - 1))
+    key_times = np.arange(0.0, frames, max(1.0, 1.0 / key_density))
+
+    namespaces = character_namespaces(characters) if characters > 1 else [('', '')]
+    for source_namespace, target_namespace in namespaces:
+        source_prefix = f'{source_namespace}:' if source_namespace else ''
+        target_prefix = f'{target_namespace}:' if target_namespace else ''
+        source_root = target_root = None
+        for entry in mapping:
+            source = source_prefix + entry['source_joint']
+            target = target_prefix + entry['target_control']
+            scene.add_node(source, 'joint', source_root)
+            scene.add_node(target, 'transform', target_root)
+            source_root = source_root or source
+            target_root = target_root or target
+
+            attrs = ['rx', 'ry', 'rz'] + (['tx', 'ty', 'tz'] if entry.get('move_able') else [])
+            for attr in attrs:
+                phase, amplitude = rng.uniform(0, np.pi), rng.uniform(5, 60)
+                values = amplitude * np.sin(key_times / 30.0 + phase)
+                scene.add_curve(f'{source}.{attr}', key_times, values)
+
+    scene.time = -1.0
+    return scene
+
+
+def run_scenario(commands, retarget, mapping, frames, key_density, solver, characters=1):
+    '''
+    Runs apply_retargeting once on a fresh scene, for every character at once when there
+    are several.
+
+    Return:
+        result: Timing, profiler phases and counts, and scene calls per phase.
+    '''
+    commands.scene = build_scene(mapping, frames, key_density, characters=characters)
+    phase_calls = {}
+    last_calls = collections.Counter()
+
+    def sink(event):
+        nonlocal last_calls
+        if event['type'] == 'phase':
+            calls = commands.scene.calls.copy()
+            delta = calls - last_calls
+            phase_calls[event['phase']] = sum(delta.values())
+            last_calls = calls
+
+    start = time.perf_counter()
+    report = retarget.apply_retargeting(mappings=mapping, solver=solver, verbosity=0, sinks=[sink],
+                                        characters=character_namespaces(characters) if characters > 1 else None)
+    seconds = time.perf_counter() - start
+
+    return {
+        'seconds': seconds,
+        'phases': report['phases'],
+        'counts': report['counts'],
+        'phase_calls': phase_calls,
+        'calls': dict(commands.scene.calls),
+    }
+
+
+def load_mapping_model():
+    '''
+    Imports the mapping table model of retargeting_ui against the fake maya modules, with a
+    Qt core application for it.
+
+    Return:
+        MappingModel: The model class, None when PySide2 is not installed.
+    '''
+    global _QT_APPLICATION
+    try:
+        from PySide2 import QtCore
+    except ImportError:
+        return None
+    sys.modules.setdefault('maya.OpenMayaUI', types.ModuleType('maya.OpenMayaUI'))
+    _QT_APPLICATION = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    import retargeting_ui
+    return retargeting_ui.MappingModel
+
+
+def run_ui_scenario(commands, retarget, mapping, model_class=None):
+    '''
+    Times the mapping operations the UI runs before Execute: compiling and validating, and
+    with model_class the table model operations of loading a config, importing rows, editing
+    and swapping cells, reading a column and deleting rows.
+
+    Return:
+        result: Total and per-step seconds, 'model_seconds' being None without a model.
+    '''
+    commands.scene = build_scene(mapping, 2, 1.0)
+    start = time.perf_counter()
+    compiled = retarget.compile_mapping(mapping)
+    compile_seconds = time.perf_counter() - start
+
+    model_seconds = None
+    if model_class is not None:
+        half = len(mapping) // 2
+        start = time.perf_counter()
+        model = model_class()
+        model.set_entries(mapping[:half])
+        model.insert_entries([{'source_joint': entry['source_joint']} for entry in mapping[half:]])
+        for row, entry in enumerate(mapping[half:], half):
+            model.setData(model.index(row, 2), entry['target_control'])
+        for row in range(0, model.rowCount() - 1, 2):
+            model.swap(model.index(row, 2), model.index(row + 1, 2))
+        model.column_values(1)
+        model.entries()
+        model.remove_rows(range(0, model.rowCount(), 2))
+        model_seconds = time.perf_counter() - start
+
+    return {'seconds': compile_seconds + (model_seconds or 0.0), 'compile_seconds': compile_seconds,
+            'model_seconds': model_seconds, 'errors': len(compiled.errors), 'calls': dict(commands.scene.calls)}
+
+
+def check_windowed_reduction(frames=1000, window=100, tolerance=0.01, seed=0):
+    '''
+    Reduces the same channels once as a whole buffer and once window by window, the way
+    stream_retargeting does, and checks that both keyings stay within tolerance of every
+    sample. The channels hold flat stretches ending in jumps on and off the window seams.
+
+    Return:
+        errors: {'full', 'windowed', 'reported'} largest errors, 'reported' being what the
+                windowed reduce_buffer report claims.
+    '''
+    import retargeting_math as retarget_math
+
+    rng = np.random.default_rng(seed)
+    times = np.arange(float(frames))
+    steps = np.repeat(rng.uniform(-10, 10, frames // window + 1), window)[:frames]
+    smooth = 20.0 * np.sin(times / 15.0)
+    values = np.column_stack((steps, np.roll(steps, window // 3), smooth, steps + smooth))
+    channels = [('ctrl', attr) for attr in ('tx', 'ty', 'tz', 'sx')]
+
+    def worst(keys):
+        return max(float(np.abs(np.interp(times, times[indices], values[indices, column])
+                                - values[:, column]).max()) for column, indices in keys.items())
+
+    full = retarget_math.BakeBuffer(times, channels, values)
+    keep, _ = retarget_math.reduce_buffer(full, tolerance)
+
+    windowed = collections.defaultdict(list)
+    report, previous = {}, {}
+    for start in range(0, frames, window):
+        part = retarget_math.BakeBuffer(times[start:start + window], channels, values[start:start + window])
+        window_keep, report = retarget_math.reduce_buffer(part, tolerance, report=report, previous=previous)
+        for column, indices in window_keep.items():
+            windowed[column].extend(indices + start)
+
+    errors = {
+        'full': worst(keep),
+        'windowed': worst({column: np.array(indices) for column, indices in windowed.items()}),
+        'reported': max(entry['max_translate_error'] for entry in report.values()),
+    }
+    if max(errors.values()) > tolerance + 1e-9 or errors['reported'] < errors['windowed'] - 1e-9:
+        raise AssertionError(f'Windowed key reduction exceeds its tolerance {tolerance}: {errors}')
+    return errors
+
+
+def run_benchmarks(sizes=(1, 4), lengths=(500, 3000), densities=(1.0, 0.25), solvers=('constraint',),
+                   repeat=1, characters=(1,)):
+    commands, retarget = install_fake_maya()
+    model_class = load_mapping_model()
+    with open(BASELINE_MAPPING, "r") as file:
+        baseline = json.load(file)
+
+    results = []
+    for size in sizes:
+        mapping = scaled_mapping(baseline, size)
+        ui_result = run_ui_scenario(commands, retarget, mapping, model_class)
+        # Without PySide2 only the mapping compile runs, it is kept apart from the full UI runs.
+        ui_name = 'ui' if model_class is not None else 'mapping_compile'
+        results.append(dict(ui_result, name=f'{ui_name}/{len(mapping)}', mappings=len(mapping)))
+        for frames, density, solver, count in itertools.product(lengths, densities, solvers, characters):
+            runs = [run_scenario(commands, retarget, mapping, frames, density, solver, count)
+                    for _ in range(repeat)]
+            best = min(runs, key=lambda run: run['seconds'])
+            name = f'{solver}/{len(mapping)}x{frames}@{density:g}' + (f'x{count}chars' if count > 1 else '')
+            results.append(dict(best, name=name, mappings=len(mapping), frames=frames,
+                                key_density=density, solver=solver, characters=count))
+            print(f"{name:<32}{best['seconds']:>9.3f}s  {sum(best['calls'].values()):>9} calls")
+    return {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}
+
+
+def compare(old, new, threshold=1.2):
+    '''
+    Prints the change of every scenario found in both runs.
+
+    Return:
+        regressions: Names of scenarios slower than threshold times, or making more scene calls.
+    '''
+    old_results = {result['name']: result for result in old['results']}
+    regressions = []
+    for result in new['results']:
+        previous = old_results.get(result['name'])
+        if previous is None:
+            continue
+        ratio = result['seconds'] / max(previous['seconds'], 1e-9)
+        old_calls, new_calls = sum(previous['calls'].values()), sum(result['calls'].values())
+        flag = ''
+        if ratio > threshold or new_calls > old_calls:
+            regressions.append(result['name'])
+            flag = '  REGRESSION'
+        print(f"{result['name']:<32}{previous['seconds']:>9.3f}s ->{result['seconds']:>9.3f}s "
+              f"({ratio:5.2f}x)  calls {old_calls} -> {new_calls}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark apply_retargeting against a simulated maya.cmds.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4], help='Copies of Fight_config.json.')
+    parser.add_argument('--frames', type=int, nargs='+', default=[500, 3000], help='Clip lengths.')
+    parser.add_argument('--densities', type=float, nargs='+', default=[1.0, 0.25], help='Keys per frame.')
+    parser.add_argument('--solvers', nargs='+', default=['constraint'], choices=['constraint', 'offline'])
+    parser.add_argument('--characters', type=int, nargs='+', default=[1],
+                        help='Characters retargeted together in one pass.')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per scenario, the fastest is kept.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files.')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Slowdown ratio reported as a regression.')
+    parser.add_argument('--check', action='store_true', help='Check windowed key reduction against a full one.')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        errors = check_windowed_reduction()
+        print(f"Key reduction max error: full {errors['full']:.4f}, windowed {errors['windowed']:.4f}")
+        return 0
+
+    if args.compare:
+        with open(args.compare[0], "r") as file:
+            old = json.load(file)
+        with open(args.compare[1], "r") as file:
+            new = json.load(file)
+        return 1 if compare(old, new, args.threshold) else 0
+
+    results = run_benchmarks(args.sizes, args.frames, args.densities, args.solvers, args.repeat, args.characters)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
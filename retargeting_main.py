@@ -1,8 +1,730 @@
 import maya.cmds as cmds
+import maya.api.OpenMaya as om
+import numpy as np
+import contextlib
+import hashlib
 import json
+import logging
+import os
+import time
+import retargeting_automap
+import retargeting_math as retarget_math
 
 
 
+class RetargetProfiler(object):
+    '''
+    Times the named phases of a retarget and counts the work done in them.
+
+    Every finished phase, and the end of the run, is sent as an event dict to each sink.
+    A sink is any callable taking the event, see logging_sink and json_report_sink, or a
+    UI callback. Messages are printed when their level is at most verbosity:
+    0 prints nothing, 1 a summary, 2 per mapping details, 3 the baked values.
+    '''
+    def __init__(self, sinks=None, verbosity=1):
+        self.sinks = list(sinks or [])
+        self.verbosity = verbosity
+        self.phases = {}
+        self.counts = {}
+        self.extra = {}
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            self.log(2, f'{name}: {seconds:.3f}s')
+            self._send({'type': 'phase', 'phase': name, 'seconds': seconds})
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def log(self, level, message):
+        if level <= self.verbosity:
+            print(message)
+
+    def report(self):
+        report = {
+            'seconds': time.perf_counter() - self._start,
+            'phases': dict(self.phases),
+            'counts': dict(self.counts),
+        }
+        report.update(self.extra)
+        return report
+
+    def finish(self):
+        report = self.report()
+        phases = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in report['phases'].items())
+        self.log(1, f"Retarget done in {report['seconds']:.2f}s ({phases})")
+        self._send({'type': 'finish', 'report': report})
+        return report
+
+    def _send(self, event):
+        for sink in self.sinks:
+            sink(event)
+
+
+def logging_sink(logger=None, level=logging.INFO):
+    '''
+    Sink logging every phase and the final report.
+    '''
+    logger = logger or logging.getLogger('retargeting')
+
+    def sink(event):
+        if event['type'] == 'phase':
+            logger.log(level, '%s took %.3fs', event['phase'], event['seconds'])
+        else:
+            logger.log(level, 'retarget report %s', json.dumps(event['report']))
+    return sink
+
+
+def json_report_sink(path):
+    '''
+    Sink writing the final report to a JSON file.
+    '''
+    def sink(event):
+        if event['type'] == 'finish':
+            with open(path, "w") as file:
+                json.dump(event['report'], file, indent=4)
+    return sink
+
+
+class FastExecution(object):
+    '''
+    Scene settings for a fast bake, applied on start and restored exactly on stop, whether
+    the bake finished, failed or was cancelled. Also usable as a with statement.
+
+    Viewport refresh is suspended, auto key is turned off, and the evaluation manager is set
+    to DG ('off') for the bake. Sampling goes through DG contexts, which the parallel
+    evaluation manager does not speed up, while every constraint created or deleted would
+    make it rebuild its graph. Undo is grouped in one chunk, or turned off without flushing
+    the queue.
+
+    Nested contexts leave the settings to the outermost one. The report only records what was
+    changed and for how long: the time saved is not measured, since the redraws and graph
+    rebuilds that were avoided cannot be counted.
+
+    Args:
+        str undo: 'chunk' for one undoable step, 'off' to record nothing, None to leave it.
+        str evaluation: Evaluation manager mode during the bake, None to leave it.
+        RetargetProfiler profiler: Receives the 'fast_execution' report in extra.
+    '''
+    _depth = 0
+
+    def __init__(self, undo='chunk', evaluation='off', suspend_refresh=True, auto_key=False, profiler=None,
+                 chunk_name='retarget'):
+        self.undo = undo
+        self.evaluation = evaluation
+        self.suspend_refresh = suspend_refresh
+        self.auto_key = auto_key
+        self.profiler = profiler or RetargetProfiler(verbosity=0)
+        self.chunk_name = chunk_name
+        self._restore = None
+
+    def start(self):
+        '''
+        Applies the settings. When one fails, the ones already applied are restored before the
+        error is raised.
+        '''
+        FastExecution._depth += 1
+        self._restore = []
+        if FastExecution._depth > 1:
+            return self
+        self._start_time = time.perf_counter()
+
+        try:
+            if self.undo == 'chunk':
+                cmds.undoInfo(openChunk=True, chunkName=self.chunk_name)
+                self._restore.append(lambda: cmds.undoInfo(closeChunk=True))
+            elif self.undo == 'off':
+                undo_state = cmds.undoInfo(query=True, state=True)
+                cmds.undoInfo(stateWithoutFlush=False)
+                self._restore.append(lambda: cmds.undoInfo(stateWithoutFlush=undo_state))
+
+            auto_key = cmds.autoKeyframe(query=True, state=True)
+            if auto_key != self.auto_key:
+                cmds.autoKeyframe(state=self.auto_key)
+                self._restore.append(lambda: cmds.autoKeyframe(state=auto_key))
+
+            if self.evaluation is not None:
+                evaluation = cmds.evaluationManager(query=True, mode=True)[0]
+                if evaluation != self.evaluation:
+                    cmds.evaluationManager(mode=self.evaluation)
+                    self._restore.append(lambda: cmds.evaluationManager(mode=evaluation))
+
+            if self.suspend_refresh:
+                cmds.refresh(suspend=True)
+                self._restore.append(lambda: cmds.refresh(suspend=False))
+        except Exception:
+            restore, self._restore = self._restore, None
+            FastExecution._depth -= 1
+            for restore_setting in reversed(restore):
+                try:
+                    restore_setting()
+                except Exception:
+                    pass
+            raise
+        return self
+
+    def stop(self):
+        '''
+        Restores every changed setting in reverse order. A setting failing to restore does
+        not keep the others from being restored, the first error is raised afterwards.
+
+        Return:
+            report: {'settings', 'undo', 'seconds'}, the count of changed settings and how
+                    long they were held, None when nested.
+        '''
+        if self._restore is None:
+            return None
+        restore, self._restore = self._restore, None
+        FastExecution._depth -= 1
+        if FastExecution._depth:
+            return None
+
+        error = None
+        for restore_setting in reversed(restore):
+            try:
+                restore_setting()
+            except Exception as e:
+                error = error or e
+
+        report = {
+            'settings': len(restore),
+            'undo': self.undo,
+            'seconds': time.perf_counter() - self._start_time,
+        }
+        self.profiler.extra['fast_execution'] = report
+        self.profiler.log(2, f"Fast execution held {report['settings']} settings for {report['seconds']:.2f}s")
+        if error is not None:
+            raise error
+        return report
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+
+def _get_plug(name):
+    selection = om.MSelectionList()
+    selection.add(name)
+    return selection.getPlug(0)
+
+
+def _plug_reader(mplug):
+    '''
+    Builds a reader returning the plug value in UI units, the same units cmds.getAttr returns.
+    '''
+    attribute = mplug.attribute()
+    if attribute.hasFn(om.MFn.kTypedAttribute) and \
+            om.MFnTypedAttribute(attribute).attrType() == om.MFnData.kMatrix:
+        return lambda: list(om.MFnMatrixData(mplug.asMObject()).matrix())
+    if attribute.hasFn(om.MFn.kUnitAttribute):
+        unit_type = om.MFnUnitAttribute(attribute).unitType()
+        if unit_type == om.MFnUnitAttribute.kAngle:
+            angle_unit = om.MAngle.uiUnit()
+            return lambda: om.MAngle(mplug.asDouble()).asUnits(angle_unit)
+        if unit_type == om.MFnUnitAttribute.kDistance:
+            distance_unit = om.MDistance.uiUnit()
+            return lambda: om.MDistance(mplug.asDouble()).asUnits(distance_unit)
+    return mplug.asDouble
+
+
+def sample_plugs(plugs, frames):
+    '''
+    Evaluates plugs at the given frames through a DG context, without moving the
+    current time or redrawing the viewport.
+
+    Args:
+        list plugs: Plug names such as 'FKSpine1_M.rx'.
+        list frames: Frames in the current time unit.
+
+    Return:
+        samples: {plug: [value for each frame]}, in the units cmds.getAttr uses.
+                 Matrix plugs give 16 floats per frame.
+    '''
+    plugs = list(dict.fromkeys(plugs))
+    readers = [_plug_reader(_get_plug(plug)) for plug in plugs]
+    samples = {plug: [] for plug in plugs}
+    columns = [samples[plug] for plug in plugs]
+    time_unit = om.MTime.uiUnit()
+
+    for frame in frames:
+        context = om.MDGContext(om.MTime(frame, time_unit))
+        previous_context = context.makeCurrent()
+        try:
+            for reader, column in zip(readers, columns):
+                column.append(reader())
+        finally:
+            previous_context.makeCurrent()
+
+    return samples
+
+
+def sample_channels(channels, frames, profiler=None):
+    '''
+    Same as sample_plugs, but fills a BakeBuffer row by row instead of building lists.
+
+    Args:
+        list channels: (node, attr) pairs.
+        list frames: Frames in the current time unit.
+
+    Return:
+        buffer: BakeBuffer of the sampled values in UI units.
+    '''
+    buffer = retarget_math.BakeBuffer(frames, channels)
+    readers = [_plug_reader(_get_plug(plug)) for plug in buffer.plugs]
+    time_unit = om.MTime.uiUnit()
+
+    for row, frame in enumerate(buffer.times):
+        context = om.MDGContext(om.MTime(float(frame), time_unit))
+        previous_context = context.makeCurrent()
+        try:
+            buffer.values[row] = [reader() for reader in readers]
+        finally:
+            previous_context.makeCurrent()
+
+    if profiler is not None:
+        profiler.count('context_evaluations', len(buffer.times))
+        profiler.count('plug_evaluations', len(buffer.times) * len(readers))
+    return buffer
+
+
+def _target_hierarchy(target_names):
+    '''
+    Finds, for every target, the nearest ancestor that is also a target.
+
+    Return:
+        paths: {target_name: long name}.
+        ancestors: {target_name: long name of the nearest retargeted ancestor, or None}.
+    '''
+    paths = {target_name: cmds.ls(target_name, long=True)[0] for target_name in target_names}
+    target_paths = set(paths.values())
+
+    ancestors = {}
+    for target_name, path in paths.items():
+        ancestor = path.rsplit('|', 1)[0]
+        while ancestor and ancestor not in target_paths:
+            ancestor = ancestor.rsplit('|', 1)[0]
+        ancestors[target_name] = ancestor or None
+    return paths, ancestors
+
+
+BIND_OFFSET_NODE = 'retargetBindOffsets'
+
+
+def _strip_namespaces(path):
+    return '|'.join(name.rsplit(':', 1)[-1] for name in path.split('|'))
+
+
+def bind_offset_keys(targets, paths, ancestors, neutral_frame):
+    '''
+    Keys the bind offset of every mapping by the rig pair it belongs to: the source and
+    target paths without namespaces, the target's retargeted ancestor, the neutral frame and
+    the rest attributes of both nodes. None of these depend on the clip, so every clip of the
+    same skeleton on the same rig shares the keys.
+
+    Return:
+        keys: {target_name: hex digest}.
+    '''
+    keys = {}
+    for source_name, target_name, move_able in targets:
+        rest = []
+        for node in (source_name, target_name):
+            attrs = ['rotateOrder', 'rotateAxis'] + (['jointOrient'] if cmds.nodeType(node) == 'joint' else [])
+            rest += [np.round(cmds.getAttr(f'{node}.{attr}'), 6).tolist() for attr in attrs]
+        identity = [_strip_namespaces(cmds.ls(source_name, long=True)[0]), _strip_namespaces(paths[target_name]),
+                    _strip_namespaces(ancestors[target_name] or ''), move_able, neutral_frame, rest]
+        keys[target_name] = hashlib.sha1(json.dumps(identity).encode('utf-8')).hexdigest()
+    return keys
+
+
+def compute_bind_offsets(targets, neutral_frame, paths, ancestors):
+    '''
+    Evaluates the neutral pose once and keeps what every mapping needs from it.
+
+    Return:
+        offsets: {target_name: {'orient': (3, 3) retargeting_math.orient_offset,
+                                'parent': (4, 4) parent matrix of the target relative to its
+                                          retargeted ancestor, None without one,
+                                'scale', 'translate': target channels at the neutral frame}}
+                 as nested lists.
+    '''
+    plugs = []
+    for source_name, target_name, _ in targets:
+        plugs += [f'{source_name}.worldMatrix[0]', f'{paths[target_name]}.worldMatrix[0]',
+                  f'{paths[target_name]}.parentMatrix[0]']
+        if ancestors[target_name] is not None:
+            plugs.append(f'{ancestors[target_name]}.worldMatrix[0]')
+    neutral = sample_plugs(plugs, [neutral_frame])
+    neutral = {plug: np.reshape(values[0], (4, 4)) for plug, values in neutral.items()}
+
+    offsets = {}
+    for source_name, target_name, _ in targets:
+        path = paths[target_name]
+        parent = None
+        if ancestors[target_name] is not None:
+            parent = (neutral[f'{path}.parentMatrix[0]'] @
+                      np.linalg.inv(neutral[f'{ancestors[target_name]}.worldMatrix[0]'])).tolist()
+        offsets[target_name] = {
+            'orient': retarget_math.orient_offset(neutral[f'{source_name}.worldMatrix[0]'],
+                                                  neutral[f'{path}.worldMatrix[0]']).tolist(),
+            'parent': parent,
+            'scale': list(cmds.getAttr(f'{target_name}.scale', time=neutral_frame)[0]),
+            'translate': list(cmds.getAttr(f'{target_name}.translate', time=neutral_frame)[0]),
+        }
+    return offsets
+
+
+def bind_offsets(targets, neutral_frame, cache=False, cache_file=None, rebind=False, profiler=None):
+    '''
+    Bind offsets of every mapping, see compute_bind_offsets.
+
+    Args:
+        list targets: (source_name, target_name, move_able) for every mapping.
+        bool cache: Reuse the offsets cached for the same rig pair and cache the missing ones,
+                    keyed by bind_offset_keys. The neutral frame is not evaluated at all when
+                    every offset is cached.
+        str cache_file: JSON file holding the cache, the BIND_OFFSET_NODE network node in the
+                        scene when None.
+        bool rebind: Solve every offset again and replace the cached ones.
+
+    Return:
+        offsets: {target_name: offsets}.
+    '''
+    profiler = profiler or RetargetProfiler(verbosity=0)
+    paths, ancestors = _target_hierarchy([target_name for _, target_name, _ in targets])
+    if not cache:
+        profiler.count('bind_offsets_solved', len(targets))
+        return compute_bind_offsets(targets, neutral_frame, paths, ancestors)
+
+    keys = bind_offset_keys(targets, paths, ancestors, neutral_frame)
+    stored = {} if rebind else _read_stored(BIND_OFFSET_NODE, cache_file) or {}
+    missing = [target for target in targets if keys[target[1]] not in stored]
+    if missing:
+        solved = {keys[target_name]: offset for target_name, offset in
+                  compute_bind_offsets(missing, neutral_frame, paths, ancestors).items()}
+        # Read again right before writing, another process may have added offsets meanwhile.
+        _write_stored(BIND_OFFSET_NODE, dict(_read_stored(BIND_OFFSET_NODE, cache_file) or {}, **solved), cache_file)
+        stored.update(solved)
+
+    profiler.count('bind_offsets_cached', len(targets) - len(missing))
+    profiler.count('bind_offsets_solved', len(missing))
+    profiler.log(2, f'Bind offsets: {len(targets) - len(missing)} cached, {len(missing)} solved')
+    return {target_name: stored[keys[target_name]] for _, target_name, _ in targets}
+
+
+def clear_bind_offsets(cache_file=None):
+    '''
+    Invalidates every cached bind offset, for example after the neutral pose of a rig or a
+    skeleton changed.
+    '''
+    _clear_stored(BIND_OFFSET_NODE, cache_file)
+
+
+def _constraint_offset(orient):
+    '''
+    Converts an orient offset to the xyz Euler offset of an orientConstraint, in UI units.
+    '''
+    degrees_to_ui = om.MAngle(1.0, om.MAngle.kDegrees).asUnits(om.MAngle.uiUnit())
+    return tuple(retarget_math.matrix_to_euler(np.array([orient]), 'xyz')[0] * degrees_to_ui)
+
+
+def solve_offline(targets, frames, neutral_frame, offsets=None):
+    '''
+    Bakes orient (maintain offset) and point constraint results without creating constraint
+    nodes. Source world matrices are sampled once and every frame is solved at once with
+    retargeting_math. Targets are solved parents first, so a control whose parent is also
+    retargeted is placed under its parent's solved pose rather than its current one.
+
+    Args:
+        list targets: (source_name, target_name, move_able) for every mapping.
+        list frames: Frames to solve.
+        int neutral_frame: Frame of the pose both rigs share, used for the orient offsets.
+        dict offsets: bind_offsets of the targets, solved from neutral_frame when None.
+
+    Return:
+        buffer: BakeBuffer with the rotate channels of every target and the translate
+                channels of move_able targets, in UI units.
+    '''
+    degrees_to_ui = om.MAngle(1.0, om.MAngle.kDegrees).asUnits(om.MAngle.uiUnit())
+    internal_to_ui = om.MDistance(1.0).asUnits(om.MDistance.uiUnit())
+
+    paths, ancestors = _target_hierarchy([target_name for _, target_name, _ in targets])
+    targets = sorted(targets, key=lambda target: paths[target[1]].count('|'))
+    if offsets is None:
+        offsets = compute_bind_offsets(targets, neutral_frame, paths, ancestors)
+
+    frame_plugs = [f'{source_name}.worldMatrix[0]' for source_name, _, _ in targets]
+    frame_plugs += [f'{target_name}.parentMatrix[0]' for _, target_name, _ in targets
+                    if ancestors[target_name] is None]
+    sampled = sample_plugs(frame_plugs, frames)
+    sampled = {plug: np.reshape(values, (-1, 4, 4)) for plug, values in sampled.items()}
+
+    channels = []
+    for _, target_name, move_able in targets:
+        channels += [(target_name, attr) for attr in (['tx', 'ty', 'tz'] if move_able else [])]
+        channels += [(target_name, attr) for attr in ['rx', 'ry', 'rz']]
+    buffer = retarget_math.BakeBuffer(frames, channels)
+
+    solved_world = {}
+    for source_name, target_name, move_able in targets:
+        ancestor = ancestors[target_name]
+        offset = offsets[target_name]
+        if ancestor is None:
+            parent_world = sampled[f'{target_name}.parentMatrix[0]']
+        else:
+            parent_world = np.array(offset['parent']) @ solved_world[ancestor]
+
+        rotate_order = retarget_math.ROTATE_ORDERS[cmds.getAttr(f'{target_name}.rotateOrder')]
+        rotate_axis = np.array(cmds.getAttr(f'{target_name}.rotateAxis')[0]) / degrees_to_ui
+        joint_orient = None
+        if cmds.nodeType(target_name) == 'joint':
+            joint_orient = np.array(cmds.getAttr(f'{target_name}.jointOrient')[0]) / degrees_to_ui
+        pivot = np.array(cmds.getAttr(f'{target_name}.rotatePivot')[0]) / internal_to_ui
+        pivot_translate = np.array(cmds.getAttr(f'{target_name}.rotatePivotTranslate')[0]) / internal_to_ui
+        scale = offset['scale']
+
+        source_world = sampled[f'{source_name}.worldMatrix[0]']
+        rotate = retarget_math.solve_orient(source_world, offset['orient'], parent_world,
+                                            rotate_order, rotate_axis, joint_orient)
+        if move_able:
+            translate = retarget_math.solve_point(source_world, parent_world, pivot, pivot_translate)
+        else:
+            translate = np.array(offset['translate']) / internal_to_ui
+
+        rotation = retarget_math.euler_to_matrix(rotate, rotate_order)
+        rotation = retarget_math.euler_to_matrix(rotate_axis) @ rotation
+        if joint_orient is not None:
+            rotation = rotation @ retarget_math.euler_to_matrix(joint_orient)
+        local = retarget_math.compose_matrix(rotation, translate, scale, pivot, pivot_translate)
+        solved_world[paths[target_name]] = local @ parent_world
+
+        buffer.set_columns(target_name, ['rx', 'ry', 'rz'], rotate * degrees_to_ui)
+        if move_able:
+            buffer.set_columns(target_name, ['tx', 'ty', 'tz'], translate * internal_to_ui)
+
+    return buffer
+
+
+def collect_frames(source_plugs, policy='keys', frame_range=None, step=1.0):
+    '''
+    Finds the frames to bake with one key-time query over every mapped source plug.
+
+    When frame_range is None the playback range is used, and sources with no keys at all
+    (driven by expressions or constraints) fall back to every frame of that range.
+
+    Return:
+        frames: Sorted list of frames.
+    '''
+    key_times = []
+    if policy in ('keys', 'subframes'):
+        key_times = cmds.keyframe(source_plugs, query=True, timeChange=True) or []
+
+    if frame_range is None and (policy in ('range', 'step') or not key_times):
+        frame_range = (cmds.playbackOptions(query=True, minTime=True),
+                       cmds.playbackOptions(query=True, maxTime=True))
+    if policy in ('keys', 'subframes') and not key_times:
+        policy = 'range'
+
+    return retarget_math.sampling_frames(key_times, policy, frame_range, step).tolist()
+
+
+def filter_rotations(buffer, previous=None):
+    '''
+    Runs the Euler filter in place on every node that has rx, ry and rz in the buffer.
+
+    Args:
+        dict previous: {node: [rx, ry, rz]} last filtered rotations of the window before this
+                       one, the filter continues from them. It is updated with the last row
+                       of the buffer for the next window.
+    '''
+    full_turn = om.MAngle(360.0, om.MAngle.kDegrees).asUnits(om.MAngle.uiUnit())
+    r_attrs = ['rx', 'ry', 'rz']
+    for node in buffer.nodes():
+        if all((node, attr) in buffer.index for attr in r_attrs):
+            rotate_order = retarget_math.ROTATE_ORDERS[cmds.getAttr(f'{node}.rotateOrder')]
+            last = previous.get(node) if previous is not None else None
+            filtered = retarget_math.euler_filter(buffer.columns(node, r_attrs), rotate_order, full_turn, last)
+            buffer.set_columns(node, r_attrs, filtered)
+            if previous is not None and len(filtered):
+                previous[node] = filtered[-1].tolist()
+
+
+ANIM_CURVE_TYPES = {
+    'doubleLinear': 'animCurveTL',
+    'doubleAngle': 'animCurveTA',
+}
+
+
+def _delete_curves(plug, profiler):
+    old_curves = cmds.listConnections(plug, source=True, destination=False, type='animCurve') or []
+    if old_curves:
+        cmds.delete(old_curves)
+        profiler.count('scene_calls')
+    profiler.count('scene_calls')
+
+
+def _create_curve(plug, key_times, key_values, in_tangent, out_tangent, profiler):
+    '''
+    Creates an animCurve of the plug's type holding the given keys, without connecting it.
+    '''
+    curve_type = ANIM_CURVE_TYPES.get(cmds.getAttr(plug, type=True), 'animCurveTU')
+    curve_name = plug.split('|')[-1].replace(':', '_').replace('.', '_')
+    curve = cmds.createNode(curve_type, name=curve_name, skipSelect=True)
+
+    time_values = np.column_stack((key_times, key_values)).ravel().tolist()
+    cmds.setAttr(f'{curve}.ktv[0:{len(key_times) - 1}]', *time_values)
+    cmds.keyTangent(curve, edit=True, inTangentType=in_tangent, outTangentType=out_tangent)
+    profiler.count('scene_calls', 4)
+    profiler.count('keys_written', len(key_times))
+    return curve
+
+
+def _write_curve(plug, key_times, key_values, in_tangent, out_tangent, profiler):
+    '''
+    Replaces the animCurve driving plug with one holding the given keys. A single key
+    becomes a plain value without a curve.
+    '''
+    _delete_curves(plug, profiler)
+    if len(key_times) == 1:
+        cmds.setAttr(plug, key_values[0])
+        profiler.count('scene_calls')
+        return None
+
+    curve = _create_curve(plug, key_times, key_values, in_tangent, out_tangent, profiler)
+    cmds.connectAttr(f'{curve}.output', plug, force=True)
+    profiler.count('scene_calls')
+    return curve
+
+
+def _default_tangents(in_tangent, out_tangent):
+    if in_tangent is None:
+        in_tangent = cmds.keyTangent(query=True, g=True, inTangentType=True)[0]
+    if out_tangent is None:
+        out_tangent = cmds.keyTangent(query=True, g=True, outTangentType=True)[0]
+    return in_tangent, out_tangent
+
+
+def _reduction_tangents(in_tangent, out_tangent):
+    '''
+    Key reduction bounds the error of linear interpolation between the kept keys, so the
+    reduced curves are written with linear tangents.
+    '''
+    for tangent in (in_tangent, out_tangent):
+        if tangent not in (None, 'linear'):
+            raise ValueError(f"Reduced keys are written with linear tangents, got {tangent!r}")
+    return 'linear', 'linear'
+
+
+def write_anim_curves(buffer, in_tangent=None, out_tangent=None, keep=None, profiler=None):
+    '''
+    Writes baked values as one animCurve per plug, replacing the curve already driving it.
+    All keys of a curve are set with a single setAttr on its keyTimeValue array, and the
+    whole write is recorded as one undo chunk.
+
+    Args:
+        BakeBuffer buffer: Baked values, one animCurve is written per channel.
+        str in_tangent: In tangent type, the user default when None.
+        str out_tangent: Out tangent type, the user default when None.
+        dict keep: {column: indices} of the keys to write, as reduce_buffer returns.
+                   Channels reduced to a single key get a plain value and no curve, as do
+                   the buffer's static channels.
+
+    Return:
+        curves: {plug: animCurve name}.
+    '''
+    profiler = profiler or RetargetProfiler(verbosity=0)
+    in_tangent, out_tangent = _default_tangents(in_tangent, out_tangent)
+
+    curves = {}
+    times = buffer.times
+    if not len(times):
+        return curves
+
+    cmds.undoInfo(openChunk=True, chunkName='retargetWriteKeys')
+    try:
+        for column, plug in enumerate(buffer.plugs):
+            indices = keep[column] if keep is not None else slice(None)
+            if buffer.channels[column] in buffer.static:
+                indices = slice(0, 1)
+            curve = _write_curve(plug, times[indices], buffer.values[indices, column],
+                                 in_tangent, out_tangent, profiler)
+            if curve is not None:
+                curves[plug] = curve
+    finally:
+        cmds.undoInfo(closeChunk=True)
+
+    return curves
+
+
+def append_anim_curves(buffer, curves, key_counts, in_tangent=None, out_tangent=None, keep=None, profiler=None):
+    '''
+    Appends the keys of one window to the curves made for the windows before it, as one
+    undo chunk. The curves are not connected, the targets may still be constrained, see
+    connect_anim_curves.
+
+    Args:
+        dict curves: {plug: animCurve name}, updated with the curves made for new plugs.
+        dict key_counts: {plug: keys already on its curve}, updated with the appended keys.
+        dict keep: {column: indices} of the keys to write, as reduce_buffer returns.
+    '''
+    profiler = profiler or RetargetProfiler(verbosity=0)
+    in_tangent, out_tangent = _default_tangents(in_tangent, out_tangent)
+    if not len(buffer.times):
+        return
+
+    cmds.undoInfo(openChunk=True, chunkName='retargetWriteKeys')
+    try:
+        for column, plug in enumerate(buffer.plugs):
+            indices = keep[column] if keep is not None else slice(None)
+            if buffer.channels[column] in buffer.static:
+                # Keyed once by the first window.
+                if plug in curves:
+                    continue
+                indices = slice(0, 1)
+            key_times, key_values = buffer.times[indices], buffer.values[indices, column]
+            if plug not in curves:
+                curves[plug] = _create_curve(plug, key_times, key_values, in_tangent, out_tangent, profiler)
+                key_counts[plug] = len(key_times)
+                continue
+
+            first = key_counts[plug]
+            last = first + len(key_times) - 1
+            time_values = np.column_stack((key_times, key_values)).ravel().tolist()
+            cmds.setAttr(f'{curves[plug]}.ktv[{first}:{last}]', *time_values)
+            # The key before the window gets its tangents again now that it has a neighbour.
+            cmds.keyTangent(curves[plug], edit=True, index=(max(first - 1, 0), last),
+                            inTangentType=in_tangent, outTangentType=out_tangent)
+            key_counts[plug] = last + 1
+            profiler.count('scene_calls', 2)
+            profiler.count('keys_written', len(key_times))
+    finally:
+        cmds.undoInfo(closeChunk=True)
+
+
+def connect_anim_curves(curves, profiler=None):
+    '''
+    Connects curves, {plug: animCurve name}, replacing the curves that drove the plugs.
+    '''
+    profiler = profiler or RetargetProfiler(verbosity=0)
+    cmds.undoInfo(openChunk=True, chunkName='retargetWriteKeys')
+    try:
+        for plug, curve in curves.items():
+            _delete_curves(plug, profiler)
+            cmds.connectAttr(f'{curve}.output', plug, force=True)
+            profiler.count('scene_calls')
+    finally:
+        cmds.undoInfo(closeChunk=True)
+
+
 '''
 Forming the full name of the source and target joint.
 
@@ -16,101 +738,1106 @@ Return:
     
 ''' 
 
-def apply_retargeting(target_namespace = '', source_namespace = '',mappings = None,config_file=None, neutral_frame=-1):
+def get_full_name(obj, namespace = None):
+    if namespace:
+        full_name = f'{namespace}:{obj}'
+        return full_name
+    else:
+        return obj
 
-    def get_full_name(obj, namespace = None):
-        if namespace:
-            full_name = f'{namespace}:{obj}'
-            return full_name
-        else:
-            return obj
+
+_MAPPING_CACHE = {}
+
+
+class MappingValidationError(Exception):
+    '''
+    Raised before any scene change when a mapping does not match the scene.
+    '''
+    def __init__(self, errors):
+        self.errors = errors
+        lines = [f"{'character %d ' % error['character'] if 'character' in error else ''}row {error['row']}: "
+                 f"{error['field']} '{error['name']}' {error['error']}" for error in errors]
+        super(MappingValidationError, self).__init__('Invalid mapping:\n' + '\n'.join(lines))
+
+
+def load_mapping(config_file):
+    '''
+    Reads a mapping JSON, cached on its path and modification time so that unchanged
+    configs are parsed only once per session.
+    '''
+    path = os.path.abspath(config_file)
+    key = (path, os.path.getmtime(path))
+    if key not in _MAPPING_CACHE:
+        with open(path,"r") as file:
+            _MAPPING_CACHE[key] = json.load(file)
+    return _MAPPING_CACHE[key]
+
+
+def auto_mapping(source_namespace='', target_namespace='', rules=None, min_confidence=0.3):
+    '''
+    Proposes a mapping between the joints of source_namespace and the curve controls of
+    target_namespace from their names and hierarchies, see retargeting_automap.auto_map.
+    The scene is read with one ls call per side and one listRelatives for the controls.
+
+    Args:
+        dict rules: Rule set from retargeting_automap.load_rules, the default rules when None.
+        float min_confidence: Pairs scoring below this are left out.
+
+    Return:
+        mappings: Mapping dicts without namespaces, each with its 'confidence'.
+    '''
+    joints = cmds.ls(get_full_name('*', source_namespace), type='joint', long=True) or []
+    shapes = cmds.ls(get_full_name('*', target_namespace), type='nurbsCurve', long=True) or []
+    controls = list(dict.fromkeys(cmds.listRelatives(shapes, parent=True, fullPath=True) or [])) if shapes else []
+    return retargeting_automap.auto_map([_strip_namespaces(path) for path in joints],
+                                        [_strip_namespaces(path) for path in controls], rules, min_confidence)
 
 
-    print(f"Target {target_namespace}\tsource {source_namespace}")
+TRANSLATE_CHANNELS = ['tx', 'ty', 'tz']
+ROTATE_CHANNELS = ['rx', 'ry', 'rz']
 
-    with open(config_file,"r") as file:
-        mappings = json.load(file)
+
+def entry_channels(entry):
+    '''
+    Target channels requested by a mapping entry, in tx..rz order: its "channels" list when
+    it has one, such as ["tx", "tz", "ry"] for a root moving on the ground plane, otherwise
+    the rotate channels plus the translate channels when move_able. Translate channels are
+    only baked for move_able entries.
+    '''
+    channels = entry.get("channels")
+    if channels is None:
+        channels = TRANSLATE_CHANNELS + ROTATE_CHANNELS
+    allowed = (TRANSLATE_CHANNELS if entry.get("move_able") else []) + ROTATE_CHANNELS
+    return [attr for attr in allowed if attr in channels]
+
+
+class CompiledMapping(object):
+    '''
+    A mapping resolved once against a pair of namespaces.
+
+    Attributes:
+        list entries: The mapping dicts, as in the config file.
+        list targets: (source_name, target_name, move_able) for every entry, namespaced.
+        list channels: The target channels planned for every entry, see entry_channels.
+                       validate removes the locked and non-keyable ones.
+        list errors: Problems found by validate, one dict per problem with 'row', 'field',
+                     'name' and 'error' ('empty', 'missing', 'ambiguous', 'unknown' for a
+                     channel override naming no channel, or 'locked' when none of the
+                     entry's channels can be keyed). An entry left with no channel by its
+                     override gets an 'empty' error on 'channels'.
+        list dropped: Channels validate removed from the plan, dicts with 'row', 'name' and
+                      'reason' ('locked' or 'not keyable').
+    '''
+    def __init__(self, entries, target_namespace='', source_namespace=''):
+        self.entries = list(entries)
+        self.target_namespace = target_namespace
+        self.source_namespace = source_namespace
+        self.targets = [(get_full_name(entry.get("source_joint"), source_namespace),
+                         get_full_name(entry.get("target_control"), target_namespace),
+                         bool(entry.get("move_able")))
+                        for entry in self.entries]
+        self.channels = [entry_channels(entry) for entry in self.entries]
+        self.errors = []
+        self.dropped = []
+
+    def subset(self, rows):
+        '''
+        CompiledMapping of only the given rows, keeping their resolved names and channels.
+        '''
+        mapping = CompiledMapping([], self.target_namespace, self.source_namespace)
+        mapping.entries = [self.entries[row] for row in rows]
+        mapping.targets = [self.targets[row] for row in rows]
+        mapping.channels = [self.channels[row] for row in rows]
+        return mapping
+
+    def validate(self):
+        '''
+        Checks every name and target channel with one ls call and one pass over the
+        target plugs, and stores the result in errors. Locked and non-keyable target
+        channels are dropped from channels instead of failing the bake.
+
+        Return:
+            errors: The list of problems, empty when the mapping can be baked.
+        '''
+        errors = []
+        names = []
+        for row, (entry, target) in enumerate(zip(self.entries, self.targets)):
+            for attr in entry.get("channels") or []:
+                if attr not in TRANSLATE_CHANNELS + ROTATE_CHANNELS:
+                    errors.append({'row': row, 'field': 'channels', 'name': attr, 'error': 'unknown'})
+            for field, name in (('source_joint', target[0]), ('target_control', target[1])):
+                if not entry.get(field):
+                    errors.append({'row': row, 'field': field, 'name': '', 'error': 'empty'})
+                else:
+                    names.append((row, field, name))
+
+        found = {}
+        for node in cmds.ls(list(dict.fromkeys(name for _, _, name in names))) or []:
+            short_name = node.split('|')[-1]
+            found[short_name] = found.get(short_name, 0) + 1
+
+        valid_rows = set()
+        for row, field, name in names:
+            short_name = name.split('|')[-1]
+            if short_name not in found:
+                errors.append({'row': row, 'field': field, 'name': name, 'error': 'missing'})
+            elif found[short_name] > 1 and '|' not in name:
+                errors.append({'row': row, 'field': field, 'name': name, 'error': 'ambiguous'})
+            elif field == 'target_control':
+                valid_rows.add(row)
+
+        selection = om.MSelectionList()
+        plugs = []
+        for row in sorted(valid_rows):
+            _, target_name, _ = self.targets[row]
+            for attr in self.channels[row]:
+                selection.add(f'{target_name}.{attr}')
+                plugs.append((row, attr, f'{target_name}.{attr}'))
+
+        dropped = []
+        for index, (row, attr, plug) in enumerate(plugs):
+            mplug = selection.getPlug(index)
+            reason = 'locked' if mplug.isLocked else None if mplug.isKeyable else 'not keyable'
+            if reason:
+                dropped.append({'row': row, 'name': plug, 'reason': reason})
+                self.channels[row] = [channel for channel in self.channels[row] if channel != attr]
+        dropped_rows = {drop['row'] for drop in dropped}
+        for row in sorted(valid_rows):
+            if not self.channels[row] and row in dropped_rows:
+                errors.append({'row': row, 'field': 'target_control', 'name': self.targets[row][1],
+                               'error': 'locked'})
+            elif not self.channels[row]:
+                errors.append({'row': row, 'field': 'channels', 'name': '', 'error': 'empty'})
+
+        self.dropped = dropped
+        self.errors = sorted(errors, key=lambda error: error['row'])
+        return self.errors
+
+
+def compile_mapping(mappings=None, config_file=None, target_namespace='', source_namespace='', validate=True,
+                    characters=None):
+    '''
+    Builds a CompiledMapping from mappings passed in memory, such as the UI table, or from
+    the cached config_file when mappings is None. A CompiledMapping is returned as it is.
+
+    Args:
+        list characters: (source_namespace, target_namespace) pairs sharing the mapping. The
+                         mapping is repeated once per character in a single CompiledMapping,
+                         so every character is constrained, sampled and keyed in the same
+                         pass. The namespace arguments are ignored when given, a single
+                         character's namespaces become the mapping's.
+
+    Return:
+        mapping: CompiledMapping, its errors list is filled when validate is on. With
+                 characters every error also has 'character', the index of its pair, and
+                 'row' is the row in the mapping.
+    '''
+    if isinstance(mappings, CompiledMapping):
+        return mappings
+    if mappings is None:
+        mappings = load_mapping(config_file)
+    if not characters:
+        mapping = CompiledMapping(mappings, target_namespace, source_namespace)
+        if validate:
+            mapping.validate()
+        return mapping
+
+    mapping = CompiledMapping([])
+    for source_namespace, target_namespace in characters:
+        character = CompiledMapping(mappings, target_namespace, source_namespace)
+        mapping.entries += character.entries
+        mapping.targets += character.targets
+        mapping.channels += character.channels
+    if len(characters) == 1:
+        # A single character keeps its namespaces, a retarget cache exported from it records them.
+        mapping.source_namespace, mapping.target_namespace = characters[0]
+    if validate:
+        for error in mapping.validate() + mapping.dropped:
+            error['character'], error['row'] = divmod(error['row'], len(mappings))
+    return mapping
+
+
+STATIC_COMPOUNDS = {
+    't': ['tx', 'ty', 'tz'],
+    'r': ['rx', 'ry', 'rz'],
+    's': ['sx', 'sy', 'sz'],
+    'sh': ['shxy', 'shxz', 'shyz'],
+    'ra': ['rax', 'ray', 'raz'],
+    'jo': ['jox', 'joy', 'joz'],
+    'rp': ['rpx', 'rpy', 'rpz'],
+    'rpt': ['rptx', 'rpty', 'rptz'],
+    'sp': ['spx', 'spy', 'spz'],
+    'spt': ['sptx', 'spty', 'sptz'],
+}
+# Every input of a node's local matrix: the compounds and their children, rotate order,
+# offset parent matrix and inherits transform.
+STATIC_ATTRS = [attr for compound, children in STATIC_COMPOUNDS.items() for attr in [compound] + children]
+STATIC_ATTRS += ['ro', 'opm', 'it']
+STATIC_TOLERANCE = 1e-6
+
+
+def _ancestor_paths(path):
+    parts = path.split('|')
+    return ['|'.join(parts[:end]) for end in range(len(parts) - 1, 1, -1)]
+
+
+def _curve_moves(curve, start, end, unit):
+    '''
+    Checks whether an animCurve changes value between start and end: its values at both ends
+    and at every key in between are compared.
+    '''
+    first = curve.evaluate(om.MTime(start, unit))
+    values = [curve.evaluate(om.MTime(end, unit))]
+    values += [curve.value(index) for index in range(curve.numKeys)
+               if start <= curve.input(index).asUnits(unit) <= end]
+    return any(abs(value - first) > STATIC_TOLERANCE for value in values)
+
+
+def moving_nodes(paths, frame_range, ignore=()):
+    '''
+    Finds the nodes whose local matrix can change over frame_range. An input of it holds
+    still when nothing drives it or when an animCurve drives it with a constant value over
+    the range, any other input (expression, constraint, rig node) counts as moving. Inputs
+    are checked on the compounds (translate, rotate...) as well as on their children, see
+    STATIC_ATTRS, attributes a node does not have are skipped.
+
+    Args:
+        list paths: Long names of the nodes to check.
+        tuple frame_range: (start, end) in the current time unit.
+        set ignore: (path, attr) channels left out of the check. A compound is left out
+                    when all its children are.
+
+    Return:
+        moving: Set of the paths that move.
+    '''
+    selection = om.MSelectionList()
+    for path in paths:
+        selection.add(path)
+
+    unit = om.MTime.uiUnit()
+    moving = set()
+    for index, path in enumerate(paths):
+        node = om.MFnDependencyNode(selection.getDependNode(index))
+        for attr in STATIC_ATTRS:
+            children = STATIC_COMPOUNDS.get(attr, [attr])
+            if all((path, child) in ignore for child in children) or not node.hasAttribute(attr):
+                continue
+            source = node.findPlug(attr, False).source()
+            if source.isNull:
+                continue
+            driver = source.node()
+            if not driver.hasFn(om.MFn.kAnimCurve) or _curve_moves(om.MFnAnimCurve(driver), *frame_range, unit):
+                moving.add(path)
+                break
+    return moving
+
+
+def static_rows(mapping, frame_range, profiler=None):
+    '''
+    Finds the mapping rows whose baked channels would hold one value over frame_range.
+
+    A target's channels follow the world transform of its source and of its own parent. So
+    a row is static when neither its source joint nor any ancestor of it moves, and when no
+    ancestor of its target moves either, counting retargeted ancestors as moving unless
+    their own row is static. The planned channels of the targets are not checked, the bake
+    replaces them.
+
+    Return:
+        rows: Set of the static row indices.
+    '''
+    profiler = profiler or RetargetProfiler(verbosity=0)
+    source_paths, _ = _target_hierarchy([source_name for source_name, _, _ in mapping.targets])
+    target_paths, _ = _target_hierarchy([target_name for _, target_name, _ in mapping.targets])
+    profiler.count('scene_calls', len(source_paths) + len(target_paths))
+
+    rows = {}
+    ignore = set()
+    for row, ((source_name, target_name, _), attrs) in enumerate(zip(mapping.targets, mapping.channels)):
+        path = target_paths[target_name]
+        rows[path] = row
+        ignore.update((path, attr) for attr in attrs)
+
+    chains = []
+    nodes = set()
+    for source_name, target_name, _ in mapping.targets:
+        source_chain = [source_paths[source_name]] + _ancestor_paths(source_paths[source_name])
+        target_chain = _ancestor_paths(target_paths[target_name])
+        chains.append((source_chain, target_chain))
+        nodes.update(source_chain + target_chain)
+    moving = moving_nodes(sorted(nodes), frame_range, ignore)
+
+    static = set()
+    order = sorted(range(len(chains)), key=lambda row: target_paths[mapping.targets[row][1]].count('|'))
+    for row in order:
+        source_chain, target_chain = chains[row]
+        if moving.intersection(source_chain) or moving.intersection(target_chain):
+            continue
+        if all(rows[path] in static for path in target_chain if path in rows):
+            static.add(row)
+    return static
+
+
+def bake_windows(target_namespace = '', source_namespace = '',mappings = None,config_file=None, neutral_frame=-1,
+                 solver='constraint', sampling='keys', frame_range=None, sample_step=1.0, shard=None,
+                 profiler=None, frames=None, cache_offsets=False, offset_cache_file=None, rebind=False,
+                 characters=None, window=None, skip=0, static_channels=True):
+    '''
+    Samples the retargeted target channels without filtering or keying them, window by
+    window. The constraints live until the generator is exhausted or closed.
+
+    Only the channels planned by the mapping are constrained and sampled, see
+    CompiledMapping.channels.
+
+    Args:
+        tuple shard: (index, count) to bake only one contiguous part of the sampled frames,
+                     as split by retargeting_math.split_frames. Every shard of a clip sees
+                     the same frames, so the merged shards match a single bake.
+        RetargetProfiler profiler: Receives the phase timings and counts.
+        list frames: Frames to sample instead of the ones found by the sampling policy.
+        bool cache_offsets: Take the orient offsets from the bind offset cache of this rig
+                            pair instead of evaluating the neutral frame, see bind_offsets.
+                            Constraints are then created with the cached offset rather than
+                            with maintain offset.
+        str offset_cache_file: JSON file of the bind offset cache, a scene node when None.
+        bool rebind: Solve the bind offsets again and replace the cached ones.
+        list characters: (source_namespace, target_namespace) pairs baked together over the
+                         union of their frames, see compile_mapping.
+        int window: Frames sampled per window, all of them in one window when None.
+        int skip: Frames already baked by an earlier run, the windows start after them.
+        bool static_channels: Sample the targets that hold still over the clip on its first
+                              frame only, see static_rows. They are listed in the buffers'
+                              static channels and keyed once.
+
+    Yields:
+        window: (frames done, total frames, BakeBuffer of the window's raw sampled values).
+
+    Raises:
+        MappingValidationError: When a name is missing or no channel of a target can be keyed,
+                                before anything is created in the scene.
+    '''
+    profiler = profiler or RetargetProfiler()
+    if characters:
+        profiler.log(1, 'Characters ' + ', '.join(f'{source} -> {target}' for source, target in characters))
+    else:
+        profiler.log(1, f"Target {target_namespace}\tsource {source_namespace}")
+
+    with profiler.phase('compile'):
+        mapping = compile_mapping(mappings, config_file, target_namespace, source_namespace,
+                                  characters=characters)
+        profiler.count('scene_calls', 1)
+    if mapping.errors:
+        raise MappingValidationError(mapping.errors)
+    for dropped in mapping.dropped:
+        profiler.log(1, f"Skipping {dropped['name']}, {dropped['reason']}")
+    profiler.count('dropped_channels', len(mapping.dropped))
 
     all_constraint_object = []
-    moveable_objects = []
-    rotate_objects = []
     
     r_attrs = ['rx','ry','rz']
     t_attrs = ['tx','ty','tz']
     
-    all_attrs = ['tx','ty','tz','rx','ry','rz']
-    all_frames = set()
-    cmds.currentTime(neutral_frame)
+    source_plugs = []
+    targets = []
+    channels = []
 
-    #print(mappings)
-    for mapping in mappings:
-        source_name = get_full_name(mapping.get("source_joint"),source_namespace)
-        target_name = get_full_name(mapping.get("target_control"),target_namespace)
-        move_able = mapping.get("move_able")
+    offsets = None
+    if cache_offsets or solver == 'offline':
+        with profiler.phase('bind_offsets'):
+            offsets = bind_offsets(mapping.targets, neutral_frame, cache_offsets, offset_cache_file,
+                                   rebind, profiler)
 
-        orient_constraint = cmds.orientConstraint(source_name,target_name, mo = True)[0]
-        all_constraint_object.append(orient_constraint)
-        
+    try:
+        with profiler.phase('constraints'):
+            if solver != 'offline' and offsets is None:
+                cmds.currentTime(neutral_frame)
+                profiler.count('scene_calls')
+                profiler.count('time_changes')
 
-        if move_able:
-            point_constraint = cmds.pointConstraint(source_name,target_name,mo = False)[0]
-            #print(parent_constraint)
-            #all_constraint_object.append(parent_constraint)
-            all_constraint_object.append(point_constraint)
-            moveable_objects.append(target_name)
+            for (source_name, target_name, move_able), attr_list in zip(mapping.targets, mapping.channels):
+                targets.append((source_name, target_name, move_able))
+                # Channels left out of the plan are skipped by the constraints, they may be locked.
+                r_skip = [attr[1] for attr in r_attrs if attr not in attr_list]
+                t_skip = [attr[1] for attr in t_attrs if attr not in attr_list]
+
+                if solver != 'offline' and len(r_skip) < 3:
+                    if offsets is None:
+                        orient_constraint = cmds.orientConstraint(source_name,target_name, mo = True,
+                                                                  skip=r_skip or 'none')[0]
+                    else:
+                        orient_constraint = cmds.orientConstraint(
+                            source_name, target_name, offset=_constraint_offset(offsets[target_name]['orient']),
+                            skip=r_skip or 'none')[0]
+                    all_constraint_object.append(orient_constraint)
+
+                if solver != 'offline' and len(t_skip) < 3:
+                    point_constraint = cmds.pointConstraint(source_name,target_name,mo = False,
+                                                            skip=t_skip or 'none')[0]
+                    all_constraint_object.append(point_constraint)
+
+                profiler.log(2, f'{source_name} -> {target_name} {attr_list}')
+
+                # Every source rotation drives each target rotation, so keys on any of them count.
+                source_plugs += [f'{source_name}.{attr}' for attr in
+                                 (t_attrs if len(t_skip) < 3 else []) + (r_attrs if len(r_skip) < 3 else [])]
+                channels += [(target_name, attr) for attr in attr_list]
+
+            profiler.count('scene_calls', len(all_constraint_object))
+            profiler.log(2, f'Constraints: {all_constraint_object}')
+
+        with profiler.phase('key_times'):
+            if frames is None:
+                frames = collect_frames(source_plugs, sampling, frame_range, sample_step)
+                profiler.count('scene_calls')
+            static = []
+            if static_channels and len(frames) > 1:
+                # Decided over every frame before sharding, so all shards agree.
+                for row in sorted(static_rows(mapping, (frames[0], frames[-1]), profiler)):
+                    static += [(mapping.targets[row][1], attr) for attr in mapping.channels[row]]
+            if shard is not None:
+                shard_index, shard_count = shard
+                frames = retarget_math.split_frames(frames, shard_count)[shard_index].tolist()
+        profiler.count('frames', len(frames) - skip)
+
+        profiler.count('channels', len(channels))
+        profiler.count('static_channels', len(static))
+        static_set = set(static)
+        moving = [channel for channel in channels if channel not in static_set]
+        static_values = None
+        window = window or max(len(frames) - skip, 1)
+        for window_start in range(skip, max(len(frames), skip + 1), window):
+            window_frames = frames[window_start:window_start + window]
+            with profiler.phase('sampling'):
+                if solver == 'offline':
+                    buffer = solve_offline(targets, window_frames, neutral_frame, offsets).select(channels)
+                    buffer.static = set(static)
+                else:
+                    buffer = sample_channels(moving, window_frames, profiler)
+                    if static:
+                        # Static channels are evaluated on the first frame only and repeated.
+                        if static_values is None:
+                            static_values = sample_channels(static, frames[:1], profiler).values[0]
+                        values = np.hstack((buffer.values, np.tile(static_values, (len(buffer), 1))))
+                        buffer = retarget_math.BakeBuffer(window_frames, moving + static, values, static)
+            yield window_start + len(window_frames), len(frames), buffer
+
+    finally:
+        if all_constraint_object:
+            with profiler.phase('cleanup'):
+                cmds.delete(all_constraint_object)
+                profiler.count('scene_calls')
+
+
+def bake_retargeting(target_namespace = '', source_namespace = '',mappings = None,config_file=None, neutral_frame=-1,
+                     solver='constraint', sampling='keys', frame_range=None, sample_step=1.0, shard=None,
+                     profiler=None, frames=None, cache_offsets=False, offset_cache_file=None, rebind=False,
+                     characters=None, static_channels=True):
+    '''
+    Samples the retargeted target channels without filtering or keying them, see
+    bake_windows for the arguments.
+
+    Return:
+        buffer: BakeBuffer of the raw sampled values.
+
+    Raises:
+        MappingValidationError: When a name is missing or no channel of a target can be keyed,
+                                before anything is created in the scene.
+    '''
+    profiler = profiler or RetargetProfiler()
+    buffer = None
+    for _, _, buffer in bake_windows(target_namespace, source_namespace, mappings, config_file, neutral_frame,
+                                     solver, sampling, frame_range, sample_step, shard, profiler, frames,
+                                     cache_offsets, offset_cache_file, rebind, characters,
+                                     static_channels=static_channels):
+        pass
+
+    profiler.log(1, f'Baked {buffer}')
+    profiler.log(3, f'{buffer.plugs}\n{buffer.times}\n{buffer.values}')
+    return buffer
+
+
+INCREMENTAL_STATE_NODE = 'retargetIncrementalState'
+
+
+def _read_stored(node, state_file=None):
+    '''
+    Reads a JSON value from state_file, or from the string attribute of a network node when
+    state_file is None.
+
+    Return:
+        value: The stored value, None when nothing was stored yet.
+    '''
+    if state_file:
+        if not os.path.exists(state_file):
+            return None
+        with open(state_file, "r") as file:
+            return json.load(file)
+    if not cmds.objExists(node):
+        return None
+    return json.loads(cmds.getAttr(f'{node}.state') or 'null')
+
+
+def _write_stored(node, value, state_file=None):
+    if state_file:
+        # Written aside and moved over, so batch workers sharing the file never read half of it.
+        temp_file = f'{state_file}.{os.getpid()}.tmp'
+        with open(temp_file, "w") as file:
+            json.dump(value, file)
+        os.replace(temp_file, state_file)
+        return
+    if not cmds.objExists(node):
+        cmds.createNode('network', name=node, skipSelect=True)
+        cmds.addAttr(node, longName='state', dataType='string')
+    cmds.setAttr(f'{node}.state', json.dumps(value), type='string')
+
+
+def _clear_stored(node, state_file=None):
+    if state_file:
+        if os.path.exists(state_file):
+            os.remove(state_file)
+    elif cmds.objExists(node):
+        cmds.delete(node)
+
+
+def read_incremental_state(state_file=None):
+    '''
+    Reads the fingerprints of the last incremental bake from state_file, or from the
+    INCREMENTAL_STATE_NODE network node when state_file is None.
+
+    Return:
+        state: The stored dict, None when nothing was stored yet.
+    '''
+    return _read_stored(INCREMENTAL_STATE_NODE, state_file)
 
+
+def write_incremental_state(state, state_file=None):
+    _write_stored(INCREMENTAL_STATE_NODE, state, state_file)
+
+
+TANGENT_TYPES = ['spline', 'linear', 'fast', 'slow', 'flat', 'step', 'stepnext', 'fixed', 'clamped', 'plateau',
+                 'auto', 'autoease', 'automix', 'autocustom']
+
+
+def source_fingerprints(nodes):
+    '''
+    Records the keys of the translate and rotate channels of nodes, with what shapes the
+    curve between them: tangent types, angles and weights, and the curve's pre and post
+    infinity and weighting. The curve settings are repeated on every key, so changing them
+    dirties the whole curve. The curves are found through the API, and each is read with one
+    keyframe and two keyTangent queries covering all its keys.
+
+    Return:
+        fingerprints: {plug: [[time, value, in type, out type, in angle, in weight, out angle,
+                      out weight, pre infinity, post infinity, weighted] for every key]},
+                      tangent types as their index in TANGENT_TYPES.
+    '''
+    plugs = [f'{node}.{attr}' for node in nodes for attr in TRANSLATE_CHANNELS + ROTATE_CHANNELS]
+    selection = om.MSelectionList()
+    for plug in plugs:
+        selection.add(plug)
+
+    fingerprints = {}
+    for index, plug in enumerate(plugs):
+        fingerprints[plug] = []
+        source = selection.getPlug(index).source()
+        if source.isNull or not source.node().hasFn(om.MFn.kAnimCurve):
+            continue
+        curve = om.MFnAnimCurve(source.node())
+        name = curve.name()
+        keys = np.reshape(cmds.keyframe(name, query=True, timeChange=True, valueChange=True) or [], (-1, 2))
+        if not len(keys):
+            continue
+        tangents = np.reshape(cmds.keyTangent(name, query=True, inAngle=True, inWeight=True, outAngle=True,
+                                              outWeight=True), (-1, 4))
+        types = cmds.keyTangent(name, query=True, inTangentType=True, outTangentType=True)
+        type_ids = np.reshape([TANGENT_TYPES.index(tangent) if tangent in TANGENT_TYPES else len(TANGENT_TYPES)
+                               for tangent in types], (-1, 2))
+        settings = [curve.preInfinityType, curve.postInfinityType, float(curve.isWeighted)]
+        rows = np.column_stack((keys, type_ids, tangents, np.tile(settings, (len(keys), 1))))
+        fingerprints[plug] = np.round(rows, 6).tolist()
+    return fingerprints
+
+
+def read_keys(plugs):
+    '''
+    Return:
+        keys: {plug: (times, values)} arrays of the keys currently on each plug.
+    '''
+    return {plug: (np.array(cmds.keyframe(plug, query=True, timeChange=True) or []),
+                   np.array(cmds.keyframe(plug, query=True, valueChange=True) or []))
+            for plug in plugs}
+
+
+def splice_anim_curves(buffer, intervals, in_tangent=None, out_tangent=None, old_keys=None, profiler=None):
+    '''
+    Replaces the keys of the target curves inside the given intervals with the baked ones and
+    keeps every key outside them. Rotations are Euler-filtered to continue from the last key
+    kept before each interval.
+
+    Args:
+        BakeBuffer buffer: Raw baked values covering the intervals.
+        dict intervals: {node: [(start, end)]} spans to replace on each node's channels.
+        dict old_keys: read_keys result taken before the bake, constraining the targets can
+                       disconnect their curves. The curves are read when None.
+    '''
+    profiler = profiler or RetargetProfiler(verbosity=0)
+    if old_keys is None:
+        old_keys = read_keys(buffer.plugs)
+        profiler.count('scene_calls', 2 * len(buffer.channels))
+    in_tangent, out_tangent = _default_tangents(in_tangent, out_tangent)
+    full_turn = om.MAngle(360.0, om.MAngle.kDegrees).asUnits(om.MAngle.uiUnit())
+    r_attrs = ['rx', 'ry', 'rz']
+
+    cmds.undoInfo(openChunk=True, chunkName='retargetSpliceKeys')
+    try:
+        for node in buffer.nodes():
+            node_intervals = intervals[node]
+            rows = retarget_math.frames_in_intervals(buffer.times, node_intervals)
+            new_times = buffer.times[rows]
+            attrs = [attr for channel_node, attr in buffer.channels if channel_node == node]
+            new_values = {attr: buffer.column(node, attr)[rows] for attr in attrs}
+            node_keys = {attr: old_keys[f'{node}.{attr}'] for attr in attrs}
+
+            if all(attr in attrs for attr in r_attrs) and len(new_times):
+                rotate_order = retarget_math.ROTATE_ORDERS[cmds.getAttr(f'{node}.rotateOrder')]
+                rotations = np.column_stack([new_values[attr] for attr in r_attrs])
+                for start, end in node_intervals:
+                    segment = (new_times >= start) & (new_times <= end)
+                    if not segment.any():
+                        continue
+                    previous = None
+                    kept_times = [node_keys[attr][0][node_keys[attr][0] < start] for attr in r_attrs]
+                    if all(len(times) for times in kept_times):
+                        previous_time = min(times[-1] for times in kept_times)
+                        previous = [np.interp(previous_time, *node_keys[attr]) for attr in r_attrs]
+                    rotations[segment] = retarget_math.euler_filter(rotations[segment], rotate_order,
+                                                                    full_turn, previous)
+                for axis, attr in enumerate(r_attrs):
+                    new_values[attr] = rotations[:, axis]
+
+            for attr in attrs:
+                old_times, old_values = node_keys[attr]
+                outside = ~retarget_math.frames_in_intervals(old_times, node_intervals)
+                times = np.concatenate((old_times[outside], new_times))
+                values = np.concatenate((old_values[outside], new_values[attr]))
+                order = np.argsort(times, kind='stable')
+                if len(times):
+                    _write_curve(f'{node}.{attr}', times[order], values[order], in_tangent, out_tangent, profiler)
+    finally:
+        cmds.undoInfo(closeChunk=True)
+
+
+def _apply_incremental(target_namespace, source_namespace, mappings, config_file, neutral_frame,
+                       in_tangent, out_tangent, solver, sampling, frame_range, sample_step,
+                       state_file, profiler, characters=None, **bind_options):
+    '''
+    Rebakes only the controls, and the frame intervals, whose source keys or mapping entry
+    changed since the last incremental bake, then splices the new keys into the target curves.
+
+    A target depends on the keys of its source joint and of every ancestor of that joint,
+    and on whatever its retargeted parent control depends on.
+    '''
+    with profiler.phase('compile'):
+        mapping = compile_mapping(mappings, config_file, target_namespace, source_namespace,
+                                  characters=characters)
+    if mapping.errors:
+        raise MappingValidationError(mapping.errors)
+
+    with profiler.phase('fingerprint'):
+        options_key = json.dumps([target_namespace, source_namespace, neutral_frame, solver, sampling,
+                                  frame_range, sample_step, characters])
+        entry_keys = {target_name: json.dumps(entry, sort_keys=True)
+                      for entry, (_, target_name, _) in zip(mapping.entries, mapping.targets)}
+
+        chains = {}
+        for source_name, target_name, _ in mapping.targets:
+            parts = cmds.ls(source_name, long=True)[0].split('|')
+            chains[target_name] = ['|'.join(parts[:index + 1]) for index in range(1, len(parts))]
+        fingerprints = source_fingerprints(sorted({node for chain in chains.values() for node in chain}))
+
+        state = read_incremental_state(state_file)
+        if state is not None and state.get('options') != options_key:
+            state = None
+
+        paths, ancestors = _target_hierarchy(list(chains))
+        names_by_path = {path: target_name for target_name, path in paths.items()}
+        dirty = {}
+        for target_name in sorted(chains, key=lambda name: paths[name].count('|')):
+            if state is None or state['entries'].get(target_name) != entry_keys[target_name]:
+                intervals = [(-np.inf, np.inf)]
+            else:
+                intervals = []
+                for node in chains[target_name]:
+                    for attr in ['tx', 'ty', 'tz', 'rx', 'ry', 'rz']:
+                        plug = f'{node}.{attr}'
+                        intervals += retarget_math.changed_intervals(state['sources'].get(plug, []),
+                                                                     fingerprints[plug])
+            if ancestors[target_name] is not None:
+                intervals += dirty.get(names_by_path[ancestors[target_name]], [])
+            dirty[target_name] = retarget_math.merge_intervals(intervals)
+
+    rebake = [index for index, (_, target_name, _) in enumerate(mapping.targets) if dirty[target_name]]
+    profiler.count('rebaked_controls', len(rebake))
+    profiler.log(1, f'Incremental bake: {len(rebake)} of {len(mapping.targets)} controls changed')
+
+    if rebake:
+        with profiler.phase('key_times'):
+            source_plugs = [f'{source_name}.{attr}' for source_name, _, move_able in mapping.targets
+                            for attr in (['tx', 'ty', 'tz', 'rx', 'ry', 'rz'] if move_able else ['rx', 'ry', 'rz'])]
+            frames = np.asarray(collect_frames(source_plugs, sampling, frame_range, sample_step))
+            all_intervals = retarget_math.merge_intervals([interval for index in rebake
+                                                           for interval in dirty[mapping.targets[index][1]]])
+            frames = frames[retarget_math.frames_in_intervals(frames, all_intervals)].tolist()
+
+            target_plugs = [f'{mapping.targets[index][1]}.{attr}' for index in rebake
+                            for attr in mapping.channels[index]]
+            old_keys = read_keys(target_plugs)
+            profiler.count('scene_calls', 2 * len(target_plugs))
+
+        subset = mapping.subset(rebake)
+        buffer = bake_retargeting(target_namespace, source_namespace, subset, None, neutral_frame,
+                                  solver, sampling, frame_range, sample_step, profiler=profiler, frames=frames,
+                                  static_channels=False, **bind_options)
+        with profiler.phase('write_keys'):
+            splice_anim_curves(buffer, dirty, in_tangent, out_tangent, old_keys, profiler)
+
+    write_incremental_state({'options': options_key, 'entries': entry_keys, 'sources': fingerprints}, state_file)
+    profiler.extra['reduction'] = None
+
+
+STREAM_CHECKPOINT_NODE = 'retargetStreamCheckpoint'
+
+
+def _resume_checkpoint(checkpoint, options_key, profiler):
+    '''
+    Checks that a checkpoint was written with the same options and that the curves it
+    recorded still hold the recorded key counts.
+
+    Return:
+        checkpoint: The checkpoint when the run can resume from it, None otherwise.
+    '''
+    if checkpoint is None or checkpoint.get('options') != options_key:
+        return None
+    profiler.count('scene_calls', 2 * len(checkpoint['curves']))
+    for plug, curve in checkpoint['curves'].items():
+        if not cmds.objExists(curve) or cmds.keyframe(curve, query=True, keyframeCount=True) != checkpoint['key_counts'][plug]:
+            return None
+    return checkpoint
+
+
+def stream_retargeting(target_namespace='', source_namespace='', mappings=None, config_file=None, neutral_frame=-1,
+                       in_tangent=None, out_tangent=None, solver='constraint', sampling='keys', frame_range=None,
+                       sample_step=1.0, window=500, reduce_keys=False, translate_tolerance=0.01,
+                       rotate_tolerance=0.1, checkpoint_file=None, profiler=None, **bake_options):
+    '''
+    Bakes, filters and keys the retarget one window of frames at a time, so memory does not
+    grow with the clip length and the keys of every finished window are already on the
+    curves. The curves are connected to the targets once the last window is keyed and the
+    constraints are gone. The Euler filter of each window continues from the last rotations
+    of the window before it, and key reduction of each window continues from the last key
+    kept before it.
+
+    After every window a checkpoint records the frames done, on a network node or in
+    checkpoint_file. A run with the same options resumes after the last completed window
+    when the curves it wrote are still in the scene, otherwise the unconnected curves of the
+    stale checkpoint are deleted before starting over. The checkpoint is removed once the
+    curves are connected, before the last progress step is yielded. Closing the generator early deletes the constraints and keeps
+    the checkpoint, discard_stream then removes what the run wrote.
+
+    Args:
+        int window: Frames per window.
+        bool reduce_keys: Reduce the keys of every window, written with linear tangents as
+                          in apply_retargeting.
+        str checkpoint_file: Checkpoint JSON, a scene node when None.
+        dict bake_options: cache_offsets, offset_cache_file, rebind and characters, see
+                           bake_windows.
+
+    Yields:
+        progress: ('bake', frames done, total frames) after every flushed window, then
+                  ('connect', curves connected, curve count) before and after connecting.
+    '''
+    profiler = profiler or RetargetProfiler()
+    options_key = json.dumps([target_namespace, source_namespace, getattr(mappings, 'entries', mappings), config_file,
+                              neutral_frame, solver, sampling, frame_range, sample_step, window, reduce_keys,
+                              translate_tolerance, rotate_tolerance, bake_options.get('characters')])
+    stored = _read_stored(STREAM_CHECKPOINT_NODE, checkpoint_file)
+    checkpoint = _resume_checkpoint(stored, options_key, profiler)
+    if checkpoint is None and stored:
+        # A run with other options, or whose curves changed, cannot resume: its curves go.
+        discard_stream(checkpoint_file)
+    if checkpoint is None:
+        checkpoint = {'options': options_key, 'frames': 0, 'previous': {}, 'curves': {}, 'key_counts': {},
+                      'last_keys': {}}
+    else:
+        profiler.log(1, f"Resuming after {checkpoint['frames']} frames")
+    if reduce_keys:
+        in_tangent, out_tangent = _reduction_tangents(in_tangent, out_tangent)
+    in_tangent, out_tangent = _default_tangents(in_tangent, out_tangent)
+
+    report = {} if reduce_keys else None
+    for done, total, buffer in bake_windows(target_namespace, source_namespace, mappings, config_file, neutral_frame,
+                                            solver, sampling, frame_range, sample_step, profiler=profiler,
+                                            window=window, skip=checkpoint['frames'], **bake_options):
+        with profiler.phase('euler_filter'):
+            filter_rotations(buffer, checkpoint['previous'])
+        keep = None
+        if reduce_keys:
+            with profiler.phase('reduce'):
+                keep, report = retarget_math.reduce_buffer(buffer, translate_tolerance, rotate_tolerance, report,
+                                                           checkpoint.setdefault('last_keys', {}))
+        with profiler.phase('write_keys'):
+            append_anim_curves(buffer, checkpoint['curves'], checkpoint['key_counts'], in_tangent, out_tangent,
+                               keep, profiler)
+        with profiler.phase('checkpoint'):
+            checkpoint['frames'] = done
+            _write_stored(STREAM_CHECKPOINT_NODE, checkpoint, checkpoint_file)
+        profiler.log(2, f'{done} of {total} frames keyed')
+        yield 'bake', done, total
+
+    yield 'connect', 0, len(checkpoint['curves'])
+    with profiler.phase('connect_keys'):
+        connect_anim_curves(checkpoint['curves'], profiler)
+    # Cleared before the last yield, a cancel from there on has nothing left to discard.
+    _clear_stored(STREAM_CHECKPOINT_NODE, checkpoint_file)
+    profiler.extra['reduction'] = report
+    yield 'connect', len(checkpoint['curves']), len(checkpoint['curves'])
+
+
+def discard_stream(checkpoint_file=None):
+    '''
+    Deletes the curves of an unfinished windowed bake and its checkpoint. They were never
+    connected, so the targets keep the curves they had before the bake. Curves already
+    connected to their plug are kept.
+    '''
+    checkpoint = _read_stored(STREAM_CHECKPOINT_NODE, checkpoint_file)
+    if checkpoint:
+        curves = [curve for plug, curve in checkpoint['curves'].items()
+                  if cmds.objExists(curve) and not cmds.isConnected(f'{curve}.output', plug)]
+        if curves:
+            cmds.delete(curves)
+    _clear_stored(STREAM_CHECKPOINT_NODE, checkpoint_file)
+
+
+def mapping_hash(mapping):
+    '''
+    Hashes the rows of a CompiledMapping without their namespaces. Every key of a row counts,
+    with move_able as a bool and the channels it plans, see entry_channels. Only the auto
+    mapping confidence is left out.
+    '''
+    rows = []
+    for entry in mapping.entries:
+        row = {key: value for key, value in entry.items() if key != 'confidence'}
+        row.update(move_able=bool(entry.get('move_able')), channels=entry_channels(entry))
+        rows.append(row)
+    return hashlib.sha1(json.dumps(rows, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def hierarchy_hash(names):
+    '''
+    Hashes the long paths of nodes without their namespaces, so a rig or skeleton keeps
+    its identifier across scenes and namespaces. Names missing from the scene hash as
+    themselves.
+    '''
+    names = list(dict.fromkeys(names))
+    paths = {path.split('|')[-1]: path for path in cmds.ls(names, long=True) or []}
+    identity = sorted(_strip_namespaces(paths.get(name, name)) for name in names)
+    return hashlib.sha1(json.dumps(identity).encode('utf-8')).hexdigest()
+
+
+def export_retarget_cache(path, buffer, mapping, dtype='float32', profiler=None):
+    '''
+    Writes filtered baked values to a binary retarget cache, see retargeting_math.save_buffer.
+    Channels are stored without namespaces, with a header identifying the mapping, the
+    target rig and the source skeleton they were baked from.
+
+    Args:
+        BakeBuffer buffer: Euler-filtered values of the mapping's targets.
+        CompiledMapping mapping: The mapping the buffer was baked with.
+        str dtype: Value type on disk, 'float32' or 'float64'.
+
+    Return:
+        header: The header as written.
+
+    Raises:
+        ValueError: When two channels only differ by namespace, as with several characters.
+                    Export one cache per character instead.
+    '''
+    profiler = profiler or RetargetProfiler(verbosity=0)
+    channels = [(_strip_namespaces(node), attr) for node, attr in buffer.channels]
+    if len(set(channels)) != len(channels):
+        raise ValueError('Cached channels must not differ only by namespace, export one cache per character')
+
+    header = {
+        'mapping_hash': mapping_hash(mapping),
+        'target_rig': hierarchy_hash([target for _, target, _ in mapping.targets]),
+        'source_skeleton': hierarchy_hash([source for source, _, _ in mapping.targets]),
+        'target_namespace': mapping.target_namespace,
+        'source_namespace': mapping.source_namespace,
+    }
+    profiler.count('scene_calls', 4)
+    with profiler.phase('export_cache'):
+        static = [(_strip_namespaces(node), attr) for node, attr in buffer.static]
+        stored = retarget_math.BakeBuffer(buffer.times, channels, buffer.values, static)
+        header = retarget_math.save_buffer(path, stored, header, dtype)
+    profiler.log(1, f'Cached {len(channels)} channels over {len(buffer)} frames to {path}')
+    return header
+
+
+def read_retarget_cache(path, target_namespace=None, mappings=None, config_file=None, controls=None,
+                        frame_range=None, check=True, profiler=None):
+    '''
+    Reads a binary retarget cache back as a BakeBuffer for the targets in the scene. Only the
+    requested controls and frames are read from disk.
+
+    Args:
+        str target_namespace: Namespace of the target rig in this scene, the one the cache
+                              was exported from when None.
+        list mappings: Mapping the cache must have been baked with, or config_file. Not
+                       checked when both are None.
+        list controls: Target controls to read, without namespace, every control when None.
+        tuple frame_range: Inclusive (start, end) to read, every frame when None.
+        bool check: Raise when the mapping or the target rig hierarchy does not match the
+                    header.
+
+    Return:
+        buffer: BakeBuffer named after the namespaced targets, ready for write_anim_curves.
+    '''
+    profiler = profiler or RetargetProfiler(verbosity=0)
+    with profiler.phase('read_cache'):
+        header = retarget_math.load_buffer_header(path)
+        if target_namespace is None:
+            target_namespace = header['target_namespace']
+        channels = None
+        if controls is not None:
+            controls = set(controls)
+            channels = [channel for channel in header['channels'] if channel[0].split('|')[-1] in controls]
+        buffer, header = retarget_math.load_buffer(path, channels, frame_range)
+
+    nodes = [get_full_name(node, target_namespace) for node in buffer.nodes()]
+    if check:
+        if mappings is not None or config_file is not None:
+            mapping = compile_mapping(mappings, config_file, target_namespace, validate=False)
+            if mapping_hash(mapping) != header['mapping_hash']:
+                raise ValueError(f'{path} was baked with a different mapping')
+        if controls is None and hierarchy_hash(nodes) != header['target_rig']:
+            raise ValueError(f'{path} was baked for a different target rig')
+        profiler.count('scene_calls', 2)
+
+    channels = [(get_full_name(node, target_namespace), attr) for node, attr in buffer.channels]
+    static = [(get_full_name(node, target_namespace), attr) for node, attr in buffer.static]
+    profiler.log(1, f'Read {len(channels)} channels over {len(buffer)} frames from {path}')
+    return retarget_math.BakeBuffer(buffer.times, channels, buffer.values, static)
+
+
+def apply_retargeting(target_namespace = '', source_namespace = '',mappings = None,config_file=None, neutral_frame=-1,
+                      in_tangent=None, out_tangent=None, solver='constraint',
+                      sampling='keys', frame_range=None, sample_step=1.0,
+                      reduce_keys=False, translate_tolerance=0.01, rotate_tolerance=0.1, buffer=None,
+                      profiler=None, verbosity=1, sinks=None, incremental=False, state_file=None,
+                      cache_offsets=False, offset_cache_file=None, rebind=False, characters=None,
+                      window=None, checkpoint_file=None, cache_file=None, export_cache=None, fast=True,
+                      undo='chunk'):
+    '''
+    Bakes the retarget, Euler-filters the rotations and writes the keys, inside a
+    FastExecution context unless fast is off.
+
+    Args:
+        BakeBuffer buffer: Already baked raw values, for example the merged shards of a
+                           sharded bake. The bake stage is skipped when given.
+        RetargetProfiler profiler: Collects phase timings and counts, one is made from
+                                   verbosity and sinks when None.
+        bool reduce_keys: Only keep the keys needed to stay within translate_tolerance and
+                          rotate_tolerance of the bake, see retargeting_math.reduce_buffer.
+                          The error is bounded for linear interpolation, so the keys are
+                          written with linear tangents and other tangent types raise a
+                          ValueError.
+        bool incremental: Only rebake the controls and frame intervals whose source keys or
+                          mapping entry changed since the last incremental bake, and splice
+                          the new keys into the existing curves. Key reduction is skipped.
+        str state_file: Sidecar JSON for the incremental fingerprints, they are kept on a
+                        network node in the scene when None.
+        bool cache_offsets: Reuse the bind offsets cached for this source and target rig
+                            pair, see bake_retargeting.
+        str offset_cache_file: JSON file of the bind offset cache, a scene node when None.
+        bool rebind: Solve the bind offsets again and replace the cached ones.
+        list characters: (source_namespace, target_namespace) pairs sharing the mapping,
+                         retargeted together in one pass over the union of their frames
+                         instead of target_namespace and source_namespace.
+        int window: Bake, filter and key this many frames at a time with bounded memory and
+                    a resumable checkpoint, see stream_retargeting.
+        str checkpoint_file: Checkpoint JSON of the windowed bake, a scene node when None.
+        str cache_file: Binary retarget cache to key the targets from instead of baking,
+                        checked against the mapping and rig, see read_retarget_cache. Only
+                        frame_range is read when given.
+        str export_cache: Writes the filtered bake to this binary retarget cache before the
+                          keys are reduced and written. The clip is then baked in one
+                          pass, window is ignored. Raises a ValueError before baking with
+                          more than one character or with incremental.
+        bool fast: Suspend refresh, undo and auto key while retargeting, see FastExecution.
+        str undo: 'chunk' to undo the whole retarget in one step, 'off' to record no undo.
+
+    Return:
+        report: The profiler report, {'seconds', 'phases', 'counts', 'reduction'}, where
+                reduction is the retargeting_math.reduce_buffer report or None, and
+                'fast_execution' the FastExecution report when fast is on.
+    '''
+    if incremental and buffer is None and (cache_file or export_cache):
+        raise ValueError('Incremental retargeting neither reads nor exports a retarget cache')
+    if export_cache and characters and len(characters) > 1:
+        raise ValueError('A retarget cache holds one character, export one cache per character')
+    profiler = profiler or RetargetProfiler(sinks, verbosity)
+    if reduce_keys and not (incremental and buffer is None):
+        in_tangent, out_tangent = _reduction_tangents(in_tangent, out_tangent)
+
+    with FastExecution(undo, profiler=profiler) if fast else contextlib.nullcontext():
+        if incremental and buffer is None:
+            _apply_incremental(target_namespace, source_namespace, mappings, config_file, neutral_frame,
+                               in_tangent, out_tangent, solver, sampling, frame_range, sample_step,
+                               state_file, profiler, characters=characters, cache_offsets=cache_offsets,
+                               offset_cache_file=offset_cache_file, rebind=rebind)
+        elif window and buffer is None and not cache_file and not export_cache:
+            for _ in stream_retargeting(target_namespace, source_namespace, mappings, config_file, neutral_frame,
+                                        in_tangent, out_tangent, solver, sampling, frame_range, sample_step, window,
+                                        reduce_keys, translate_tolerance, rotate_tolerance, checkpoint_file,
+                                        profiler, cache_offsets=cache_offsets, offset_cache_file=offset_cache_file,
+                                        rebind=rebind, characters=characters):
+                pass
         else:
-            rotate_objects.append(target_name)
+            if cache_file and buffer is None:
+                buffer = read_retarget_cache(cache_file, target_namespace, mappings, config_file,
+                                             frame_range=frame_range, profiler=profiler)
+            elif buffer is None:
+                buffer = bake_retargeting(target_namespace, source_namespace, mappings, config_file, neutral_frame,
+                                          solver, sampling, frame_range, sample_step, profiler=profiler,
+                                          cache_offsets=cache_offsets, offset_cache_file=offset_cache_file,
+                                          rebind=rebind, characters=characters)
 
-        attr_list = all_attrs
-        if not move_able:
-            attr_list = r_attrs
-        
-        print(attr_list)
+            with profiler.phase('euler_filter'):
+                filter_rotations(buffer)
 
-        for attr in attr_list:
-            attr_name = f'{source_name}.{attr}'
-            frame = cmds.keyframe(attr_name, query = True, timeChange = True)
-            frame = [] if frame is None else frame
-            all_frames.update(frame)
+            if export_cache:
+                mapping = compile_mapping(mappings, config_file, target_namespace, source_namespace,
+                                          validate=False, characters=characters)
+                export_retarget_cache(export_cache, buffer, mapping, profiler=profiler)
 
-    print(all_constraint_object)
-    
-    all_value = {}
-    for frame in sorted(all_frames):
-        cmds.currentTime(frame)
-        all_value[frame] = {}
-        for obj in rotate_objects:
-            all_value[frame][obj] = {}
-            for attr in r_attrs:
-                all_value[frame][obj][attr] = cmds.getAttr(f'{obj}.{attr}')
-
-        for obj in moveable_objects:
-            all_value[frame][obj] = {}
-            for attr in all_attrs:
-                all_value[frame][obj][attr] = cmds.getAttr(f'{obj}.{attr}')
-        
-    cmds.delete(all_constraint_object)
-    print(all_value)
-    
-    
-    for current_frame, frame_value in all_value.items():
-        for obj, attributes in frame_value.items():
-            for attri_name, attr in attributes.items():
-                cmds.setKeyframe(f'{obj}.{attri_name}',value = attr,time = current_frame)
-    
+            keep = None
+            report = None
+            if reduce_keys:
+                with profiler.phase('reduce'):
+                    keep, report = retarget_math.reduce_buffer(buffer, translate_tolerance, rotate_tolerance)
+                for obj, entry in report.items():
+                    profiler.log(2, f"{obj}\t{entry['keys']} -> {entry['kept']} keys ({entry['ratio']:.1f}x)\t"
+                                    f"max error t {entry['max_translate_error']:.4f} "
+                                    f"r {entry['max_rotate_error']:.4f}")
+            profiler.extra['reduction'] = report
 
-    for mapping in mappings:
-        target_control = get_full_name(mapping.get('target_control'), target_namespace)
-        anim_curves = cmds.listConnections(target_control, type='animCurve') or []
-        if anim_curves:
-            cmds.filterCurve(anim_curves, filter="euler")
-    
+            with profiler.phase('write_keys'):
+                write_anim_curves(buffer, in_tangent, out_tangent, keep, profiler)
+
+    return profiler.finish()
 
 
 if __name__ == '__main__':
-    # Example usage
-    config_file = 'C:/Users/Administrator/Documents/retarget/config.json'
-    target_namespace = 'Fight'
-    source_namespace = ''
-    apply_retargeting(target_namespace, source_namespace, config_file)
\ No newline at end of file
+    # Headless usage goes through the batch driver, see retargeting_batch.py
+    import sys
+    import retargeting_batch
+    sys.exit(retargeting_batch.main())
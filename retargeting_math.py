@@ -0,0 +1,651 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+
+'''
+Pure NumPy math and bake storage used by the retargeting pipeline. Nothing in this module imports Maya,
+so it can be run and checked against reference matrices outside of a Maya session.
+
+Matrices follow Maya's row-vector convention: a point is transformed as point * matrix,
+and a child's world matrix is local * parent_world. Angles are in degrees.
+'''
+
+ROTATE_ORDERS = ('xyz', 'yzx', 'zxy', 'xzy', 'yxz', 'zyx')
+
+_AXIS_INDEX = {'x': 0, 'y': 1, 'z': 2}
+
+
+def _axis_rotation(axis, radians):
+    '''
+    Builds row-vector rotation matrices about one axis, shape (N, 3, 3).
+    '''
+    cos = np.cos(radians)
+    sin = np.sin(radians)
+    matrices = np.zeros(radians.shape + (3, 3))
+    i = axis
+    j = (axis + 1) % 3
+    k = (axis + 2) % 3
+    matrices[..., i, i] = 1.0
+    matrices[..., j, j] = cos
+    matrices[..., j, k] = sin
+    matrices[..., k, j] = -sin
+    matrices[..., k, k] = cos
+    return matrices
+
+
+def euler_to_matrix(angles, rotate_order='xyz'):
+    '''
+    Converts Euler angles to rotation matrices.
+
+    Args:
+        array angles: (N, 3) rotations about x, y and z in degrees.
+        str rotate_order: One of ROTATE_ORDERS, the first axis is applied first.
+
+    Return:
+        matrices: (N, 3, 3) row-vector rotation matrices.
+    '''
+    radians = np.radians(np.asarray(angles, dtype=float))
+    matrices = None
+    for axis_name in rotate_order:
+        axis = _AXIS_INDEX[axis_name]
+        rotation = _axis_rotation(axis, radians[..., axis])
+        matrices = rotation if matrices is None else matrices @ rotation
+    return matrices
+
+
+def matrix_to_euler(matrices, rotate_order='xyz'):
+    '''
+    Converts rotation matrices to Euler angles, the inverse of euler_to_matrix.
+
+    Args:
+        array matrices: (N, 3, 3) row-vector rotation matrices.
+        str rotate_order: One of ROTATE_ORDERS.
+
+    Return:
+        angles: (N, 3) rotations about x, y and z in degrees.
+    '''
+    i, j, k = (_AXIS_INDEX[axis_name] for axis_name in rotate_order)
+    # Odd permutations flip the sign of every angle.
+    parity = 1.0 if (j - i) % 3 == 1 else -1.0
+    # Work on the column-vector form, where the first axis is the right-most rotation.
+    m = np.swapaxes(np.asarray(matrices, dtype=float), -1, -2)
+
+    cos_j = np.sqrt(m[..., i, i] ** 2 + m[..., j, i] ** 2)
+    first = np.arctan2(parity * m[..., k, j], m[..., k, k])
+    second = np.arctan2(-parity * m[..., k, i], cos_j)
+    third = np.arctan2(parity * m[..., j, i], m[..., i, i])
+
+    # At gimbal lock the first and third angles share one axis, put it all on the first.
+    locked = cos_j < 1e-9
+    if np.any(locked):
+        first = np.where(locked, np.arctan2(-parity * m[..., j, k], m[..., j, j]), first)
+        third = np.where(locked, 0.0, third)
+
+    angles = np.empty(m.shape[:-2] + (3,))
+    angles[..., i] = first
+    angles[..., j] = second
+    angles[..., k] = third
+    return np.degrees(angles)
+
+
+def orthonormalize(matrices):
+    '''
+    Strips scale from the rotation part of (N, 4, 4) or (N, 3, 3) matrices.
+
+    Return:
+        rotations: (N, 3, 3) matrices with unit-length axis rows.
+    '''
+    rotations = np.asarray(matrices, dtype=float)[..., :3, :3]
+    return rotations / np.linalg.norm(rotations, axis=-1, keepdims=True)
+
+
+def compose_matrix(rotation, translate, scale=(1.0, 1.0, 1.0), pivot=(0.0, 0.0, 0.0),
+                   pivot_translate=(0.0, 0.0, 0.0)):
+    '''
+    Builds transform matrices as Maya does for a transform whose scale pivot sits on its
+    rotate pivot: -pivot * scale * rotation * (pivot + pivot_translate + translate).
+
+    Args:
+        array rotation: (N, 3, 3) combined rotation, including rotate axis and joint orient.
+        array translate: (N, 3) or (3,) translate values.
+
+    Return:
+        matrices: (N, 4, 4).
+    '''
+    rotation = np.asarray(rotation, dtype=float)
+    count = rotation.shape[0]
+    pivot = np.asarray(pivot, dtype=float)
+    linear = np.asarray(scale, dtype=float)[:, None] * rotation
+    matrices = np.zeros((count, 4, 4))
+    matrices[:, :3, :3] = linear
+    matrices[:, 3, :3] = (-pivot @ linear) + pivot + np.asarray(pivot_translate, dtype=float) + \
+        np.broadcast_to(np.asarray(translate, dtype=float), (count, 3))
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def orient_offset(source_neutral, target_neutral):
+    '''
+    Rotation offset that orientConstraint with maintain offset keeps between a source and a
+    target, target_world = offset * source_world at the neutral pose.
+
+    Args:
+        array source_neutral: (4, 4) source world matrix at the neutral frame.
+        array target_neutral: (4, 4) target world matrix at the neutral frame.
+
+    Return:
+        offset: (3, 3) rotation matrix.
+    '''
+    return orthonormalize(target_neutral) @ orthonormalize(source_neutral).T
+
+
+def solve_orient(source_world, offset, parent_world, rotate_order='xyz', rotate_axis=None, joint_orient=None):
+    '''
+    Vectorized equivalent of orientConstraint with maintain offset.
+
+    The offset from orient_offset is applied so that target_world = offset * source_world,
+    then the result is moved into the target's parent space and decomposed into its
+    rotate channels.
+
+    Args:
+        array source_world: (N, 4, 4) source world matrices for every frame.
+        array offset: (3, 3) rotation offset from orient_offset.
+        array parent_world: (N, 4, 4) target parent world matrices for every frame.
+        str rotate_order: Rotate order of the target.
+        array rotate_axis: (3,) rotateAxis of the target in degrees.
+        array joint_orient: (3,) jointOrient of the target in degrees, for joints.
+
+    Return:
+        angles: (N, 3) values for rx, ry and rz in degrees.
+    '''
+    source_rotation = orthonormalize(source_world)
+    target_rotation = np.asarray(offset, dtype=float) @ source_rotation
+    local = target_rotation @ np.swapaxes(orthonormalize(parent_world), -1, -2)
+
+    if rotate_axis is not None:
+        local = euler_to_matrix(rotate_axis).T @ local
+    if joint_orient is not None:
+        local = local @ euler_to_matrix(joint_orient).T
+    return matrix_to_euler(local, rotate_order)
+
+
+def solve_point(source_world, parent_world, pivot=(0.0, 0.0, 0.0), pivot_translate=(0.0, 0.0, 0.0)):
+    '''
+    Vectorized equivalent of pointConstraint without offset.
+
+    Args:
+        array source_world: (N, 4, 4) source world matrices for every frame.
+        array parent_world: (N, 4, 4) target parent world matrices for every frame.
+        array pivot: (3,) rotatePivot of the target.
+        array pivot_translate: (3,) rotatePivotTranslate of the target.
+
+    Return:
+        translate: (N, 3) values for tx, ty and tz.
+    '''
+    source_position = np.asarray(source_world, dtype=float)[:, 3, :]
+    local_position = np.einsum('ni,nij->nj', source_position, np.linalg.inv(parent_world))
+    return local_position[:, :3] - np.asarray(pivot, dtype=float) - np.asarray(pivot_translate, dtype=float)
+
+
+def euler_filter(angles, rotate_order='xyz', full_turn=360.0, previous=None):
+    '''
+    Vectorized equivalent of filterCurve -filter euler on one rotation, done before keying.
+
+    Every frame picks, among the equivalent Euler solutions, the one closest to the frame
+    before it: either the same angles or the alternate solution (first + 180, 180 - middle,
+    last + 180), then every axis is unwrapped by whole turns. Both solutions are always the
+    same distance from each other's neighbours, so the choice only depends on consecutive
+    frames and reduces to a cumulative parity.
+
+    Args:
+        array angles: (N, 3) rotations about x, y and z.
+        str rotate_order: Rotate order of the channels, decides which axis is the middle one.
+        float full_turn: 360.0 for degrees, 2 * pi for radians.
+        array previous: (3,) already filtered rotation of the frame just before angles, to
+                        continue a curve across a seam. The first frame is then filtered too.
+
+    Return:
+        angles: (N, 3) filtered rotations, the first frame is left as it is unless previous
+                is given.
+    '''
+    if previous is not None:
+        angles = np.vstack((np.reshape(previous, (1, 3)), angles))
+        return euler_filter(angles, rotate_order, full_turn)[1:]
+    angles = np.array(angles, dtype=np.float64)
+    if len(angles) < 2:
+        return angles
+    half_turn = full_turn / 2.0
+    middle = _AXIS_INDEX[rotate_order[1]]
+
+    alternate = angles + half_turn
+    alternate[:, middle] = half_turn - angles[:, middle]
+
+    def distance(current, previous):
+        delta = np.mod(current - previous + half_turn, full_turn) - half_turn
+        return np.abs(delta).sum(axis=1)
+
+    same = distance(angles[1:], angles[:-1])
+    cross = distance(alternate[1:], angles[:-1])
+    flipped = np.concatenate(([False], np.cumsum(cross < same) % 2 == 1))
+    chosen = np.where(flipped[:, None], alternate, angles)
+
+    delta = np.diff(chosen, axis=0)
+    delta -= full_turn * np.round(delta / full_turn)
+    chosen[1:] = chosen[0] + np.cumsum(delta, axis=0)
+    return chosen
+
+
+SAMPLING_POLICIES = ('keys', 'range', 'step', 'subframes')
+
+
+def sampling_frames(key_times, policy='keys', frame_range=None, step=1.0):
+    '''
+    Builds the sorted frames to bake for a sampling policy.
+
+    Args:
+        list key_times: Key times of every mapped source plug, duplicates allowed.
+        str policy: 'keys' for the union of source keys, 'range' for every frame of
+                    frame_range, 'step' for every step frames over frame_range, 'subframes'
+                    for the source keys plus every step frames between the first and last key.
+        tuple frame_range: (start, end) used by 'range' and 'step'.
+        float step: Spacing for 'step' and 'subframes'.
+
+    Return:
+        frames: Sorted unique frames as a float array.
+    '''
+    if policy not in SAMPLING_POLICIES:
+        raise ValueError(f'Unknown sampling policy {policy!r}, expected one of {SAMPLING_POLICIES}')
+    if step <= 0:
+        raise ValueError(f'Sampling step must be positive, got {step}')
+
+    key_times = np.asarray(key_times if key_times is not None else [], dtype=np.float64)
+    if policy == 'keys':
+        frames = key_times
+    elif policy == 'subframes':
+        frames = key_times
+        if len(key_times):
+            first, last = key_times.min(), key_times.max()
+            frames = np.concatenate((key_times, np.arange(first, last, step)))
+    else:
+        start, end = frame_range
+        if end < start:
+            raise ValueError(f'Frame range end {end} is before its start {start}')
+        spacing = 1.0 if policy == 'range' else step
+        frames = np.arange(start, end + spacing * 1e-6, spacing)
+        frames = np.append(frames, end) if frames[-1] < end else frames
+
+    return np.unique(np.round(frames, 6))
+
+
+def reduce_keys(times, values, tolerance, lookahead=256, keep_last=False):
+    '''
+    Picks the keys to keep so that linear interpolation between them stays within tolerance
+    of every sampled value. Static channels keep a single key, or their first and last ones
+    with keep_last.
+
+    From each kept key the next one is the furthest sample that a straight segment can
+    reach while passing within tolerance of every sample in between, found with a running
+    window of admissible slopes.
+
+    Args:
+        array times: (N,) sample times.
+        array values: (N,) sampled values of one channel.
+        float tolerance: Largest allowed error, in the channel's units.
+        int lookahead: Samples checked at once from each key, grown when not enough.
+        bool keep_last: Always keep the last sample, for values followed by more keys.
+
+    Return:
+        indices: Sorted indices of the kept samples.
+    '''
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    if count and np.ptp(values) <= tolerance:
+        return np.array([0, count - 1]) if keep_last and count > 1 else np.array([0])
+    if count <= 2:
+        return np.arange(count)
+
+    epsilon = 1e-12
+    kept = [0]
+    anchor = 0
+    while anchor < count - 1:
+        window = lookahead
+        while True:
+            end = min(count, anchor + 1 + window)
+            elapsed = times[anchor + 1:end] - times[anchor]
+            delta = values[anchor + 1:end] - values[anchor]
+            slope = delta / elapsed
+            lowest = np.maximum.accumulate((delta - tolerance) / elapsed)
+            highest = np.minimum.accumulate((delta + tolerance) / elapsed)
+            reachable = (slope >= lowest - epsilon) & (slope <= highest + epsilon)
+            blocked = np.flatnonzero(lowest > highest + epsilon)
+            if len(blocked) or end == count:
+                break
+            window *= 2
+
+        limit = blocked[0] if len(blocked) else len(reachable)
+        anchor += 1 + np.flatnonzero(reachable[:limit])[-1]
+        kept.append(anchor)
+
+    return np.array(kept)
+
+
+def reduce_buffer(buffer, translate_tolerance=0.01, rotate_tolerance=0.1, report=None, previous=None):
+    '''
+    Runs reduce_keys on every channel of a BakeBuffer. Rotate channels (rx, ry, rz) use
+    rotate_tolerance, every other channel uses translate_tolerance.
+
+    Args:
+        dict report: Report of earlier windows of the same bake to add this one to.
+        dict previous: {plug: [time, value]} of the last key kept in the window before, for a
+                       bake reduced one window at a time. Each channel is then reduced from
+                       that key on, so the error is measured across the window seam, and the
+                       window's last sample is always kept. Updated with this window's last key.
+
+    Return:
+        keep: {column: indices of the kept keys}.
+        report: {node: {'keys', 'kept', 'ratio', 'max_translate_error', 'max_rotate_error'}}.
+    '''
+    keep = {}
+    report = {} if report is None else report
+    for column, (node, attr) in enumerate(buffer.channels):
+        rotate = attr in ('rx', 'ry', 'rz')
+        times = buffer.times
+        values = buffer.values[:, column]
+        plug = f'{node}.{attr}'
+        seam = previous is not None and plug in previous
+        if seam:
+            times = np.concatenate(([previous[plug][0]], times))
+            values = np.concatenate(([previous[plug][1]], values))
+        indices = reduce_keys(times, values, rotate_tolerance if rotate else translate_tolerance,
+                              keep_last=previous is not None)
+
+        error = 0.0
+        if len(indices):
+            error = float(np.abs(np.interp(times, times[indices], values[indices]) - values).max())
+        if previous is not None and len(indices):
+            previous[plug] = [float(times[indices[-1]]), float(values[indices[-1]])]
+        if seam:
+            # The key before the seam was written with the previous window.
+            indices = indices[1:] - 1
+        keep[column] = indices
+
+        entry = report.setdefault(node, {'keys': 0, 'kept': 0, 'ratio': 1.0,
+                                         'max_translate_error': 0.0, 'max_rotate_error': 0.0})
+        entry['keys'] += len(buffer.times)
+        entry['kept'] += len(indices)
+        entry['ratio'] = entry['keys'] / max(entry['kept'], 1)
+        error_key = 'max_rotate_error' if rotate else 'max_translate_error'
+        entry[error_key] = max(entry[error_key], error)
+
+    return keep, report
+
+
+def split_frames(frames, count):
+    '''
+    Splits sorted frames into count contiguous shards of near equal size.
+
+    Return:
+        shards: List of count float arrays, empty ones when there are fewer frames than shards.
+    '''
+    return np.array_split(np.asarray(frames, dtype=np.float64), count)
+
+
+def merge_buffers(buffers):
+    '''
+    Joins the shard buffers of one bake back into a single BakeBuffer in time order.
+
+    The shards hold raw values, so running the Euler filter once on the merged buffer
+    unwraps the rotations across the shard seams exactly as a single serial bake would.
+    '''
+    buffers = [buffer for buffer in buffers if len(buffer)]
+    if not buffers:
+        raise ValueError('No baked frames to merge')
+    channels = buffers[0].channels
+    for buffer in buffers[1:]:
+        if buffer.channels != channels:
+            raise ValueError('Shard buffers were baked with different channels')
+
+    buffers.sort(key=lambda buffer: buffer.times[0])
+    times = np.concatenate([buffer.times for buffer in buffers])
+    if np.any(np.diff(times) <= 0):
+        raise ValueError('Shard buffers overlap')
+    return BakeBuffer(times, channels, np.concatenate([buffer.values for buffer in buffers]), buffers[0].static)
+
+
+def merge_intervals(intervals):
+    '''
+    Merges overlapping or touching closed (start, end) intervals.
+
+    Return:
+        intervals: Sorted list of disjoint (start, end) tuples.
+    '''
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def changed_intervals(old_keys, new_keys):
+    '''
+    Finds the time intervals where a curve evaluates differently after its keys changed.
+
+    A key influences the curve between its neighbouring keys, so every added, removed or
+    edited key dirties the span from the key before it to the key after it, in the old
+    and in the new curve. Curves hold their end values, so a change at an end key is
+    open ended.
+
+    Args:
+        array old_keys: (N, K) rows of (time, value, tangent data...) sorted by time.
+        array new_keys: (M, K) rows in the same layout.
+
+    Return:
+        intervals: Merged (start, end) tuples, with -inf and inf for open ends.
+    '''
+    old_rows = {row[0]: row for row in map(tuple, np.asarray(old_keys, dtype=np.float64))}
+    new_rows = {row[0]: row for row in map(tuple, np.asarray(new_keys, dtype=np.float64))}
+    changed = sorted(key_time for key_time in set(old_rows) | set(new_rows)
+                     if old_rows.get(key_time) != new_rows.get(key_time))
+
+    intervals = []
+    for times in (np.array(sorted(old_rows)), np.array(sorted(new_rows))):
+        for key_time in changed:
+            before = np.searchsorted(times, key_time, side='left')
+            after = np.searchsorted(times, key_time, side='right')
+            start = times[before - 1] if before > 0 else -np.inf
+            end = times[after] if after < len(times) else np.inf
+            intervals.append((start, end))
+    return merge_intervals(intervals)
+
+
+def frames_in_intervals(frames, intervals):
+    '''
+    Returns a boolean mask of the frames lying inside any of the closed intervals.
+    '''
+    frames = np.asarray(frames, dtype=np.float64)
+    mask = np.zeros(len(frames), dtype=bool)
+    for start, end in intervals:
+        mask |= (frames >= start) & (frames <= end)
+    return mask
+
+
+class BakeBuffer(object):
+    '''
+    Baked channel values kept as one contiguous (frames, channels) float block.
+
+    Columns are addressed by (node, attr) through a channel index, and the frame times live
+    in their own array. Stages read and write columns as views, so nothing is copied between
+    sampling, filtering, key writing and export.
+
+    Channels in static hold one value over the whole bake: they were sampled once, and only
+    their first frame is keyed.
+    '''
+    def __init__(self, times, channels, values=None, static=None):
+        self.times = np.ascontiguousarray(times, dtype=np.float64)
+        self.channels = [tuple(channel) for channel in channels]
+        self.index = {channel: column for column, channel in enumerate(self.channels)}
+        self.static = {tuple(channel) for channel in static or []} & set(self.index)
+        if values is None:
+            values = np.zeros((len(self.times), len(self.channels)))
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        if self.values.shape != (len(self.times), len(self.channels)):
+            raise ValueError(f'Expected values of shape {(len(self.times), len(self.channels))}, '
+                             f'got {self.values.shape}')
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return f'BakeBuffer({len(self.times)} frames x {len(self.channels)} channels)'
+
+    @property
+    def plugs(self):
+        return [f'{node}.{attr}' for node, attr in self.channels]
+
+    def nodes(self):
+        '''
+        Returns every node with a channel in the buffer, in column order.
+        '''
+        return list(dict.fromkeys(node for node, _ in self.channels))
+
+    def column(self, node, attr):
+        '''
+        Returns a writable view of one channel over every frame.
+        '''
+        return self.values[:, self.index[(node, attr)]]
+
+    def columns(self, node, attrs):
+        '''
+        Returns a (frames, len(attrs)) copy of several channels of one node.
+        '''
+        return self.values[:, [self.index[(node, attr)] for attr in attrs]]
+
+    def select(self, channels):
+        '''
+        Returns a new BakeBuffer holding a copy of the given channels only.
+        '''
+        channels = [tuple(channel) for channel in channels]
+        return BakeBuffer(self.times, channels, self.values[:, [self.index[channel] for channel in channels]],
+                          self.static)
+
+    def set_columns(self, node, attrs, values):
+        values = np.asarray(values, dtype=np.float64)
+        for position, attr in enumerate(attrs):
+            self.values[:, self.index[(node, attr)]] = values[..., position]
+
+
+BUFFER_FILE_MAGIC = b'RTGCACHE'
+BUFFER_FILE_VERSION = 1
+_BUFFER_FILE_PREFIX = struct.Struct('<8sII')
+_BUFFER_FILE_ALIGN = 64
+
+
+def save_buffer(path, buffer, header=None, dtype='float32'):
+    '''
+    Writes a BakeBuffer to a compact binary file that load_buffer can memory map.
+
+    The file holds a fixed prefix (magic, version, header length), a JSON header padded to
+    64 bytes, the float64 frame times and the values stored channel by channel, so one
+    channel over a frame range is a single contiguous read. The file is written next to
+    path and moved over it, a failed write leaves the previous file in place.
+
+    Args:
+        dict header: Extra JSON-able entries kept in the header, such as the identifiers of
+                     the mapping and rigs the buffer was baked from.
+        str dtype: Value type on disk, float32 halves the size, float64 keeps the bake exact.
+
+    Return:
+        header: The header as written.
+    '''
+    dtype = np.dtype(dtype).newbyteorder('<')
+    header = dict(header or {})
+    header.update({
+        'channels': [list(channel) for channel in buffer.channels],
+        'static': [list(channel) for channel in buffer.channels if channel in buffer.static],
+        'frames': len(buffer.times),
+        'dtype': dtype.str,
+    })
+    text = json.dumps(header).encode('utf-8')
+    times_offset = -(-(_BUFFER_FILE_PREFIX.size + len(text)) // _BUFFER_FILE_ALIGN) * _BUFFER_FILE_ALIGN
+    text = text.ljust(times_offset - _BUFFER_FILE_PREFIX.size)
+
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(_BUFFER_FILE_PREFIX.pack(BUFFER_FILE_MAGIC, BUFFER_FILE_VERSION, len(text)))
+        file.write(text)
+        file.write(buffer.times.astype('<f8').tobytes())
+        file.write(np.ascontiguousarray(buffer.values.T, dtype=dtype).tobytes())
+    os.replace(temp_path, path)
+    return header
+
+
+def load_buffer_header(path):
+    '''
+    Reads the header of a save_buffer file without touching its data.
+
+    Return:
+        header: The header dict, with 'times_offset' and 'values_offset' in bytes added.
+    '''
+    with open(path, 'rb') as file:
+        prefix = file.read(_BUFFER_FILE_PREFIX.size)
+        if len(prefix) != _BUFFER_FILE_PREFIX.size:
+            raise ValueError(f'{path} is not a retarget cache')
+        magic, version, length = _BUFFER_FILE_PREFIX.unpack(prefix)
+        if magic != BUFFER_FILE_MAGIC:
+            raise ValueError(f'{path} is not a retarget cache')
+        if version != BUFFER_FILE_VERSION:
+            raise ValueError(f'{path} has cache version {version}, expected {BUFFER_FILE_VERSION}')
+        header = json.loads(file.read(length).decode('utf-8'))
+    header['times_offset'] = _BUFFER_FILE_PREFIX.size + length
+    header['values_offset'] = header['times_offset'] + 8 * header['frames']
+    return header
+
+
+def load_buffer(path, channels=None, frame_range=None):
+    '''
+    Reads a save_buffer file through a memory map, so only the pages of the selected
+    channels and frames are read from disk.
+
+    Args:
+        list channels: (node, attr) channels to read, every channel when None.
+        tuple frame_range: Inclusive (start, end) times to read, every frame when None.
+
+    Return:
+        buffer, header: A BakeBuffer in float64 and the header from load_buffer_header.
+    '''
+    header = load_buffer_header(path)
+    stored = [tuple(channel) for channel in header['channels']]
+    frames = header['frames']
+    if channels is None:
+        channels = stored
+    else:
+        channels = [tuple(channel) for channel in channels]
+        index = {channel: column for column, channel in enumerate(stored)}
+        missing = [channel for channel in channels if channel not in index]
+        if missing:
+            raise KeyError(f'Channels not in {path}: {missing}')
+    if not frames or not channels:
+        return BakeBuffer(np.zeros(0), channels, static=header.get('static')), header
+
+    times = np.memmap(path, dtype='<f8', mode='r', offset=header['times_offset'], shape=(frames,))
+    start, stop = 0, frames
+    if frame_range is not None:
+        start = int(np.searchsorted(times, frame_range[0], side='left'))
+        stop = int(np.searchsorted(times, frame_range[1], side='right'))
+
+    values = np.memmap(path, dtype=header['dtype'], mode='r', offset=header['values_offset'],
+                       shape=(len(stored), frames))
+    if channels == stored:
+        block = values[:, start:stop]
+    else:
+        block = values[[index[channel] for channel in channels], start:stop]
+    buffer = BakeBuffer(np.array(times[start:stop]), channels, np.asarray(block, dtype=np.float64).T,
+                        header.get('static'))
+    del times, values
+    return buffer, header
@@ -2,9 +2,14 @@ from PySide2 import QtWidgets, QtCore, QtGui
 from shiboken2 import wrapInstance
 from importlib import reload
 import maya.OpenMayaUI as omui
+import maya.api.OpenMaya as om
 import maya.cmds as cmds
+import bisect
+import collections
 import json
 import os
+import time
+import retargeting_automap
 import retargeting_main as retarget
 
 reload(retarget)
@@ -21,30 +26,189 @@ def get_maya_window():
     return wrapInstance(int(main_window_ptr), QtWidgets.QWidget)
 
 
+class SceneNameIndex(object):
+    """
+    Names of the joints and the curve-shaped transforms of the scene, split by namespace.
+
+    The index is built with two bulk ls/listRelatives queries and kept current through
+    API callbacks: joints added, removed and renamed are updated in place, while curve
+    shapes added or removed, scene loads, imports, references and undo/redo only mark the
+    index for a rebuild on its next use. Names are counted per node, so a name found more
+    than once is ambiguous.
+    """
+    SCENE_MESSAGES = ("kAfterNew", "kAfterOpen", "kAfterImport", "kAfterCreateReference",
+                      "kAfterLoadReference", "kAfterUnloadReference", "kAfterRemoveReference")
+    EVENTS = ("Undo", "Redo")
+
+    def __init__(self):
+        self.joints = collections.Counter()
+        self.curves = collections.Counter()
+        self._callbacks = []
+        self._dirty = True
+        self._namespaces = None
+
+    def start(self):
+        """
+        Registers the scene callbacks, stop must be called when the index is dropped.
+        """
+        self._callbacks.append(om.MDGMessage.addNodeAddedCallback(self._joint_added, "joint"))
+        self._callbacks.append(om.MDGMessage.addNodeRemovedCallback(self._joint_removed, "joint"))
+        self._callbacks.append(om.MDGMessage.addNodeAddedCallback(self._mark_dirty, "nurbsCurve"))
+        self._callbacks.append(om.MDGMessage.addNodeRemovedCallback(self._mark_dirty, "nurbsCurve"))
+        self._callbacks.append(om.MNodeMessage.addNameChangedCallback(om.MObject.kNullObj, self._renamed))
+        for message in self.SCENE_MESSAGES:
+            self._callbacks.append(om.MSceneMessage.addCallback(getattr(om.MSceneMessage, message), self._mark_dirty))
+        for event in self.EVENTS:
+            self._callbacks.append(om.MEventMessage.addEventCallback(event, self._mark_dirty))
+
+    def stop(self):
+        if self._callbacks:
+            om.MMessage.removeCallbacks(self._callbacks)
+        self._callbacks = []
+
+    def _mark_dirty(self, *args):
+        self._dirty = True
+
+    def _changed(self):
+        self._namespaces = None
+
+    def _joint_added(self, node, client_data=None):
+        self.joints[om.MFnDependencyNode(node).name()] += 1
+        self._changed()
+
+    def _joint_removed(self, node, client_data=None):
+        self.joints[om.MFnDependencyNode(node).name()] -= 1
+        self.joints += collections.Counter()
+        self._changed()
+
+    def _renamed(self, node, previous_name, client_data=None):
+        if node.hasFn(om.MFn.kJoint):
+            names = self.joints
+        elif node.hasFn(om.MFn.kTransform) and previous_name in self.curves:
+            names = self.curves
+        else:
+            return
+        if names[previous_name]:
+            names[previous_name] -= 1
+        names[om.MFnDependencyNode(node).name()] += 1
+        names += collections.Counter()
+        self._changed()
+
+    def rebuild(self):
+        self.joints = collections.Counter(name.split("|")[-1] for name in cmds.ls(type="joint", long=True) or [])
+        shapes = cmds.ls(type="nurbsCurve", long=True) or []
+        transforms = {shape.rsplit("|", 1)[0] for shape in shapes}
+        self.curves = collections.Counter(path.split("|")[-1] for path in transforms)
+        self._dirty = False
+        self._changed()
+
+    def _ensure(self):
+        if self._dirty:
+            self.rebuild()
+
+    def namespaces(self):
+        """
+        Returns {namespace: sorted names without the namespace}, "" for the root namespace.
+        """
+        self._ensure()
+        if self._namespaces is None:
+            namespaces = collections.defaultdict(set)
+            for name in list(self.joints) + list(self.curves):
+                namespace, _, short_name = name.rpartition(":")
+                namespaces[namespace].add(short_name)
+            self._namespaces = {namespace: sorted(names) for namespace, names in namespaces.items()}
+        return self._namespaces
+
+    def complete(self, text, namespace="", limit=50):
+        """
+        Suggests names of a namespace: the ones starting with text first, then the ones
+        holding the characters of text in order, case-insensitively.
+        """
+        names = self.namespaces().get(namespace, [])
+        start = bisect.bisect_left(names, text)
+        matches = []
+        for name in names[start:]:
+            if not name.startswith(text) or len(matches) >= limit:
+                break
+            matches.append(name)
+
+        pattern = text.lower()
+        found = set(matches)
+        for name in names:
+            if len(matches) >= limit:
+                break
+            lower_name = name.lower()
+            position = 0
+            for character in pattern:
+                position = lower_name.find(character, position) + 1
+                if not position:
+                    break
+            else:
+                if name not in found:
+                    matches.append(name)
+        return matches
+
+    def count(self, names):
+        """
+        Counts the nodes matching every name with one ls call for the names the index cannot
+        answer: DAG paths, and names it does not hold, in case a change was missed.
+
+        Returns:
+            dict: {name: number of matching nodes}.
+        """
+        self._ensure()
+        counts = {}
+        unknown = []
+        for name in dict.fromkeys(names):
+            found = self.joints[name] + self.curves[name] if "|" not in name else 0
+            if found:
+                counts[name] = found
+            else:
+                unknown.append(name)
+        if unknown:
+            found = collections.Counter()
+            for node in cmds.ls(unknown, long=True) or []:
+                found[node.split("|")[-1]] += 1
+            for name in unknown:
+                counts[name] = found[name.split("|")[-1]]
+                if counts[name] and "|" not in name:
+                    self._dirty = True
+        return counts
+
+
 class ComboBoxDelegate(QtWidgets.QStyledItemDelegate):
     """
     A custom delegate that provides an editable QComboBox as the editor.
-    The combo box is pre-populated with all non-empty items from the current column.
+    The combo box only holds the best matches of the cell's name among the scene names of
+    the column's namespace, and a completer suggests prefix and fuzzy matches from the name
+    index while typing, so an editor never lists the whole rig. Without a name index, or
+    without names in the namespace, it falls back to the non-empty items of the column.
     """
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, name_index=None, namespace=None):
         super(ComboBoxDelegate, self).__init__(parent)
+        self.name_index = name_index
+        self.namespace = namespace or (lambda: "")
 
     def createEditor(self, parent, option, index):
         combo = QtWidgets.QComboBox(parent)
         combo.setEditable(True)
-        # Collect all non-empty items from the column.
-        model = index.model()
-        col = index.column()
-        items = set()
-        for row in range(model.rowCount()):
-            val = model.index(row, col).data(QtCore.Qt.DisplayRole)
-            if val is not None and val != "":
-                items.add(val)
-        items = list(items)
-        items.sort()
+        current_value = index.data(QtCore.Qt.EditRole) or ""
+        items = []
+        if self.name_index is not None:
+            namespace = self.namespace()
+            if self.name_index.namespaces().get(namespace):
+                items = self.name_index.complete(current_value, namespace) or self.name_index.complete("", namespace)
+                completions = QtCore.QStringListModel(combo)
+                completer = QtWidgets.QCompleter(completions, combo)
+                completer.setCompletionMode(QtWidgets.QCompleter.UnfilteredPopupCompletion)
+                combo.setCompleter(completer)
+                combo.lineEdit().textEdited.connect(
+                    lambda text: completions.setStringList(self.name_index.complete(text, namespace)))
+        if not items:
+            # Collect all non-empty items from the column.
+            items = sorted({value for value in index.model().column_values(index.column()) if value})
         combo.addItems(items)
         # Set the current text.
-        current_value = index.data(QtCore.Qt.EditRole) or ""
         combo.setCurrentText(current_value)
         return combo
 
@@ -59,15 +223,140 @@ class ComboBoxDelegate(QtWidgets.QStyledItemDelegate):
         editor.setGeometry(option.rect)
 
 
-class MappingTable(QtWidgets.QTableWidget):
+class MappingModel(QtCore.QAbstractTableModel):
     """
-    A custom table widget for displaying mapping entries.
+    Table model over the mapping list, one dict per row as in the JSON config:
+    {"source_joint", "target_control", "move_able"}. The Moveable column is a checkable item.
+    """
+    HEADERS = ["Moveable", "Source Joint", "Target Rig Control"]
+    KEYS = ["move_able", "source_joint", "target_control"]
+
+    def __init__(self, parent=None):
+        super(MappingModel, self).__init__(parent)
+        self._entries = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._entries)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.KEYS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return str(section + 1)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self._entries[index.row()]
+        if index.column() == 0:
+            if role == QtCore.Qt.CheckStateRole:
+                return QtCore.Qt.Checked if entry["move_able"] else QtCore.Qt.Unchecked
+            return None
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return entry[self.KEYS[index.column()]]
+        if role == QtCore.Qt.ToolTipRole and "confidence" in entry:
+            return f"Auto mapped, confidence {entry['confidence']:.2f}"
+        return None
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid():
+            return False
+        entry = self._entries[index.row()]
+        if index.column() == 0 and role == QtCore.Qt.CheckStateRole:
+            entry["move_able"] = int(value) == int(QtCore.Qt.Checked)
+        elif index.column() != 0 and role == QtCore.Qt.EditRole:
+            entry[self.KEYS[index.column()]] = value or ""
+            # A name edited by hand is no longer an auto mapped guess.
+            entry.pop("confidence", None)
+        else:
+            return False
+        self.dataChanged.emit(index, index)
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.ItemIsDropEnabled
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if index.column() == 0:
+            return flags | QtCore.Qt.ItemIsUserCheckable
+        return flags | QtCore.Qt.ItemIsEditable | QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled
+
+    @staticmethod
+    def _entry(entry):
+        return dict(entry, source_joint=entry.get("source_joint") or "",
+                    target_control=entry.get("target_control") or "",
+                    move_able=bool(entry.get("move_able", False)))
+
+    def set_entries(self, entries):
+        """
+        Replaces every row with the given mapping dicts.
+        """
+        self.beginResetModel()
+        self._entries = [self._entry(entry) for entry in entries]
+        self.endResetModel()
+
+    def entries(self):
+        """
+        Returns a copy of the mapping list, ready for the JSON config or apply_retargeting.
+        The auto map confidence only lives in the model and is left out.
+        """
+        return [{key: value for key, value in entry.items() if key != "confidence"} for entry in self._entries]
+
+    def insert_entries(self, entries, row=None):
+        """
+        Inserts mapping dicts at row, at the end when None, and returns the first new row.
+        """
+        row = len(self._entries) if row is None else row
+        if entries:
+            self.beginInsertRows(QtCore.QModelIndex(), row, row + len(entries) - 1)
+            self._entries[row:row] = [self._entry(entry) for entry in entries]
+            self.endInsertRows()
+        return row
+
+    def remove_rows(self, rows):
+        # Contiguous rows go in one removal, from the bottom up so the remaining row numbers stay valid.
+        ranges = []
+        for row in sorted(set(rows), reverse=True):
+            if ranges and ranges[-1][0] == row + 1:
+                ranges[-1][0] = row
+            else:
+                ranges.append([row, row])
+        for first, last in ranges:
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            del self._entries[first:last + 1]
+            self.endRemoveRows()
+
+    def set_confidence(self, row, confidence):
+        self._entries[row]["confidence"] = confidence
+        self.dataChanged.emit(self.index(row, 1), self.index(row, 2))
+
+    def column_values(self, column):
+        return [entry[self.KEYS[column]] for entry in self._entries]
+
+    def swap(self, first, second):
+        """
+        Swaps the values of two cells of the same column.
+        """
+        key = self.KEYS[first.column()]
+        first_entry, second_entry = self._entries[first.row()], self._entries[second.row()]
+        first_entry[key], second_entry[key] = second_entry[key], first_entry[key]
+        self.dataChanged.emit(first, first)
+        self.dataChanged.emit(second, second)
+
+
+class MappingTable(QtWidgets.QTableView):
+    """
+    A table view over a MappingModel.
     This table supports cell-level dragging (with swapping) and per-cell editing via a custom delegate.
     """
     def __init__(self, parent=None):
         super(MappingTable, self).__init__(parent)
-        self.setColumnCount(3)
-        self.setHorizontalHeaderLabels(["Moveable", "Source Joint", "Target Rig Control"])
+        self.setModel(MappingModel(self))
+        self.horizontalHeader().setStretchLastSection(True)
         # Change selection behavior to individual cells.
         self.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectItems)
         self.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
@@ -88,20 +377,21 @@ class MappingTable(QtWidgets.QTableWidget):
             return
         pos = event.pos()
         target_index = self.indexAt(pos)
-        # Only swap if the drop is within the same column.
-        if (target_index.isValid() and self._start_index.isValid() and 
+        # Only swap if the drop is within the same text column.
+        if (target_index.isValid() and self._start_index.isValid() and target_index.column() != 0 and
                 self._start_index.column() == target_index.column()):
-            source_item = self.item(self._start_index.row(), self._start_index.column())
-            target_item = self.item(target_index.row(), target_index.column())
-            if source_item and target_item:
-                temp = source_item.text()
-                source_item.setText(target_item.text())
-                target_item.setText(temp)
+            self.model().swap(self._start_index, target_index)
         event.accept()
         self._start_index = None
 
 
 class RetargetingTool(QtWidgets.QDialog):
+    # Frames baked and keyed per step of the Qt event loop.
+    BAKE_WINDOW = 50
+    # Auto Map pairs scoring below this are listed for review.
+    LOW_CONFIDENCE = 0.6
+    PHASE_LABELS = {'bake': "Baking", 'connect': "Connecting curves"}
+
     def __init__(self, parent=None):
         """
         Initializes the RetargetingTool dialog UI.
@@ -119,6 +409,10 @@ class RetargetingTool(QtWidgets.QDialog):
         save_action = QtWidgets.QAction("Save JSON", self)
         save_action.triggered.connect(self.save_json_file)
         file_menu.addAction(save_action)
+        file_menu.addSeparator()
+        rules_action = QtWidgets.QAction("Load Auto Map Rules", self)
+        rules_action.triggered.connect(self.load_auto_map_rules)
+        file_menu.addAction(rules_action)
         main_layout.setMenuBar(self.menu_bar)
 
         # Namespace Inputs
@@ -131,6 +425,30 @@ class RetargetingTool(QtWidgets.QDialog):
         main_layout.addWidget(self.rig_namespace_label)
         main_layout.addWidget(self.rig_namespace_edit)
 
+        # Multiple characters sharing the mapping, retargeted together in one pass.
+        self.multi_character_checkbox = QtWidgets.QCheckBox("Retarget Multiple Characters")
+        main_layout.addWidget(self.multi_character_checkbox)
+        self.character_widget = QtWidgets.QWidget()
+        character_layout = QtWidgets.QVBoxLayout(self.character_widget)
+        character_layout.setContentsMargins(0, 0, 0, 0)
+        self.character_table = QtWidgets.QTableWidget(0, 2)
+        self.character_table.setHorizontalHeaderLabels(["Source Joint Namespace", "Target Rig Control Namespace"])
+        self.character_table.horizontalHeader().setStretchLastSection(True)
+        character_layout.addWidget(self.character_table)
+        character_btn_layout = QtWidgets.QHBoxLayout()
+        self.add_character_button = QtWidgets.QPushButton("Add Character")
+        self.add_character_button.setToolTip("Add the namespaces above as a character")
+        self.add_character_button.clicked.connect(self.add_character_entry)
+        character_btn_layout.addWidget(self.add_character_button)
+        self.delete_character_button = QtWidgets.QPushButton("Remove Character")
+        self.delete_character_button.clicked.connect(self.delete_character_entries)
+        character_btn_layout.addWidget(self.delete_character_button)
+        character_btn_layout.addStretch()
+        character_layout.addLayout(character_btn_layout)
+        self.character_widget.setVisible(False)
+        self.multi_character_checkbox.toggled.connect(self.character_widget.setVisible)
+        main_layout.addWidget(self.character_widget)
+
         # Import Options Layout (Import As and Node Type)
         import_layout = QtWidgets.QHBoxLayout()
         self.import_as_label = QtWidgets.QLabel("Import As:")
@@ -148,17 +466,28 @@ class RetargetingTool(QtWidgets.QDialog):
         self.import_selected_button = QtWidgets.QPushButton("Import Selected Objects")
         self.import_selected_button.clicked.connect(self.import_selected_objects)
         import_layout.addWidget(self.import_selected_button)
+        self.auto_map_button = QtWidgets.QPushButton("Auto Map")
+        self.auto_map_button.setToolTip("Pair the joints of the source namespace with the controls of the rig "
+                                        "namespace by name and hierarchy.")
+        self.auto_map_button.clicked.connect(self.auto_map)
+        import_layout.addWidget(self.auto_map_button)
         import_layout.addStretch()
         main_layout.addLayout(import_layout)
 
         # Mapping Table (replaces previous QTreeWidget)
         self.mapping_table = MappingTable()
+        self.mapping_model = self.mapping_table.model()
         # Set our custom delegate for columns 1 and 2.
-        self.mapping_table.setItemDelegateForColumn(1, ComboBoxDelegate(self.mapping_table))
-        self.mapping_table.setItemDelegateForColumn(2, ComboBoxDelegate(self.mapping_table))
+        # Scene names shared by the editors, the selection highlight and the pre-execute check.
+        self.name_index = SceneNameIndex()
+        self.name_index.start()
+        self.mapping_table.setItemDelegateForColumn(1, ComboBoxDelegate(
+            self.mapping_table, self.name_index, lambda: self.standardize_namespace(self.joint_namespace_edit.text())))
+        self.mapping_table.setItemDelegateForColumn(2, ComboBoxDelegate(
+            self.mapping_table, self.name_index, lambda: self.standardize_namespace(self.rig_namespace_edit.text())))
         main_layout.addWidget(self.mapping_table)
         # Connect selection change signal to highlight scene objects.
-        self.mapping_table.itemSelectionChanged.connect(self.highlight_selected_objects)
+        self.mapping_table.selectionModel().selectionChanged.connect(self.highlight_selected_objects)
 
         # Add/Delete Buttons Layout
         btn_layout = QtWidgets.QHBoxLayout()
@@ -177,8 +506,33 @@ class RetargetingTool(QtWidgets.QDialog):
         self.action_button = QtWidgets.QPushButton("Execute")
         self.action_button.clicked.connect(self.on_action_button_clicked)
         main_layout.addWidget(self.action_button)
+
+        # Progress of a running retarget, stepped from the Qt event loop.
+        self.progress_widget = QtWidgets.QWidget()
+        progress_layout = QtWidgets.QHBoxLayout(self.progress_widget)
+        progress_layout.setContentsMargins(0, 0, 0, 0)
+        self.progress_bar = QtWidgets.QProgressBar()
+        progress_layout.addWidget(self.progress_bar)
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_retargeting)
+        progress_layout.addWidget(self.cancel_button)
+        self.progress_label = QtWidgets.QLabel("")
+        main_layout.addWidget(self.progress_widget)
+        main_layout.addWidget(self.progress_label)
+        self.progress_widget.setVisible(False)
+        self.retarget_timer = QtCore.QTimer(self)
+        self.retarget_timer.setInterval(0)
+        self.retarget_timer.timeout.connect(self.step_retargeting)
+        self.retarget_steps = None
+        self.retarget_profiler = None
+        self.saved_evaluation = None
+        self.retarget_phase = None
+        self.phase_start = 0.0
+        self.phase_done = 0
+
         self.setWindowFlags(QtCore.Qt.Window | QtCore.Qt.WindowStaysOnTopHint)
         self.config_file_path = None
+        self.auto_map_rules = None
 
     def standardize_namespace(self, ns):
         ns = ns.strip()
@@ -186,28 +540,73 @@ class RetargetingTool(QtWidgets.QDialog):
             ns = ns[:-1]
         return ns
 
+    def add_character_entry(self):
+        """
+        Adds a character row filled with the current namespace fields.
+        """
+        row = self.character_table.rowCount()
+        self.character_table.insertRow(row)
+        self.character_table.setItem(row, 0, QtWidgets.QTableWidgetItem(
+            self.standardize_namespace(self.joint_namespace_edit.text())))
+        self.character_table.setItem(row, 1, QtWidgets.QTableWidgetItem(
+            self.standardize_namespace(self.rig_namespace_edit.text())))
+
+    def delete_character_entries(self):
+        rows = {index.row() for index in self.character_table.selectedIndexes()}
+        for row in sorted(rows, reverse=True):
+            self.character_table.removeRow(row)
+
+    def get_characters(self):
+        """
+        Returns the (source namespace, target namespace) pairs of the character table,
+        or None when multiple characters are off.
+        """
+        if not self.multi_character_checkbox.isChecked():
+            return None
+        characters = []
+        for row in range(self.character_table.rowCount()):
+            namespaces = [self.character_table.item(row, column) for column in (0, 1)]
+            characters.append(tuple(self.standardize_namespace(item.text()) if item is not None else ""
+                                    for item in namespaces))
+        return characters
+
     def populate_mapping_table(self, json_data):
         """
         Populates the MappingTable with the provided JSON data.
         """
-        self.mapping_table.setRowCount(0)
-        for entry in json_data:
-            row = self.mapping_table.rowCount()
-            self.mapping_table.insertRow(row)
-            # Column 0: Moveable checkbox.
-            checkbox = QtWidgets.QCheckBox()
-            checkbox.setChecked(entry.get("move_able", False))
-            self.mapping_table.setCellWidget(row, 0, checkbox)
-            # Column 1: Source Joint.
-            source_item = QtWidgets.QTableWidgetItem(entry.get("source_joint", ""))
-            source_item.setFlags(source_item.flags() | QtCore.Qt.ItemIsEditable | 
-                                   QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-            self.mapping_table.setItem(row, 1, source_item)
-            # Column 2: Target Rig Control.
-            target_item = QtWidgets.QTableWidgetItem(entry.get("target_control", ""))
-            target_item.setFlags(target_item.flags() | QtCore.Qt.ItemIsEditable | 
-                                   QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-            self.mapping_table.setItem(row, 2, target_item)
+        self.mapping_model.set_entries(json_data)
+
+    def find_import_objects(self, selected_objects, node_type):
+        """
+        Finds the joints, or the transforms with a nurbsCurve shape, of the selected objects
+        with at most one type-filtered listRelatives per selected root. A selected joint is
+        taken alone, the joints under any other selected object are all taken. Curves are
+        taken at and under every selected object.
+
+        Returns:
+            list: Shortest unique names of the found objects in hierarchy order (parents before
+                  children, siblings in Outliner order), without duplicates.
+        """
+        selected_joints = set(cmds.ls(selected_objects, type="joint", long=True) or [])
+        paths = []
+        for root in selected_objects:
+            if node_type == "Joint":
+                if root in selected_joints:
+                    paths.append(root)
+                    continue
+                # listRelatives returns the descendants in reverse depth-first order.
+                joints = cmds.listRelatives(root, allDescendents=True, type="joint", fullPath=True) or []
+                paths.extend(reversed(joints))
+            elif node_type == "Curve":
+                # The shapes of root itself are among its descendants.
+                shapes = cmds.listRelatives(root, allDescendents=True, type="nurbsCurve", fullPath=True) or []
+                paths.extend(shape.rsplit("|", 1)[0] for shape in reversed(shapes))
+        paths = list(dict.fromkeys(paths))
+
+        selection = om.MSelectionList()
+        for path in paths:
+            selection.add(path)
+        return [selection.getDagPath(index).partialPathName() for index in range(len(paths))]
 
     def import_selected_objects(self):
         """
@@ -222,196 +621,113 @@ class RetargetingTool(QtWidgets.QDialog):
         # Get desired node type.
         selected_node_type = self.node_type_combo.currentText()
 
-        selected_objects = cmds.ls(selection=True)
+        selected_objects = cmds.ls(selection=True, long=True)
         if not selected_objects:
             QtWidgets.QMessageBox.warning(self, "No Selection", "No objects selected in the scene.")
             return
 
-        all_objects = []
-        if selected_node_type == "Joint":
-            # For joints, use similar logic as before.
-            for obj in selected_objects:
-                if cmds.nodeType(obj) == "joint":
-                    all_objects.append(obj)
-                else:
-                    joints = cmds.listRelatives(obj, allDescendents=True, type="joint") or []
-                    all_objects.extend(joints)
-        elif selected_node_type == "Curve":
-            # For curves, recursively search for transforms that have a nurbsCurve shape.
-            for obj in selected_objects:
-                # Check if the selected object itself is a transform with a curve shape.
-                shapes = cmds.listRelatives(obj, shapes=True, fullPath=True) or []
-                for shape in shapes:
-                    if cmds.nodeType(shape) == "nurbsCurve":
-                        all_objects.append(obj)
-                        break
-                # Also search recursively under the object.
-                child_transforms = cmds.listRelatives(obj, allDescendents=True, type="transform") or []
-                for trans in child_transforms:
-                    shapes = cmds.listRelatives(trans, shapes=True, fullPath=True) or []
-                    for shape in shapes:
-                        if cmds.nodeType(shape) == "nurbsCurve":
-                            all_objects.append(trans)
-                            break
-
-        # Remove duplicates.
-        all_objects = list(set(all_objects))
+        all_objects = self.find_import_objects(selected_objects, selected_node_type)
         if not all_objects:
             QtWidgets.QMessageBox.warning(self, "No Objects", 
                                           f"No {selected_node_type.lower()} objects found under the selected item(s).")
             return
 
-        # Fill in the mapping table.
+        # Index the column once: the names already in it and the queue of its empty rows.
+        values = self.mapping_model.column_values(col_index)
+        present = {value.strip() for value in values}
+        empty_rows = collections.deque(row for row, value in enumerate(values) if value.strip() == "")
+        key = MappingModel.KEYS[col_index]
+        new_entries = []
         for obj in all_objects:
-            # Skip if already exists in the target column.
-            exists = False
-            for row in range(self.mapping_table.rowCount()):
-                item = self.mapping_table.item(row, col_index)
-                if item and item.text().strip() == obj:
-                    exists = True
-                    break
-            if exists:
+            if obj in present:
                 continue
+            present.add(obj)
+            if empty_rows:
+                self.mapping_model.setData(self.mapping_model.index(empty_rows.popleft(), col_index), obj)
+            else:
+                new_entries.append({key: obj, "move_able": False})
+        self.mapping_model.insert_entries(new_entries)
+
+    def auto_map(self):
+        """
+        Proposes pairs for the source joints not mapped yet and adds them to the table: a row
+        holding only the source joint gets its target control, the other pairs get new rows.
+        Pairs whose joint or control is already in the table are skipped.
+        """
+        joint_namespace = self.standardize_namespace(self.joint_namespace_edit.text())
+        rig_namespace = self.standardize_namespace(self.rig_namespace_edit.text())
+        proposals = retarget.auto_mapping(joint_namespace, rig_namespace, self.auto_map_rules)
+        if not proposals:
+            QtWidgets.QMessageBox.warning(self, "Auto Map", "No joint could be paired with a rig control.")
+            return
 
-            # Try to fill an empty cell.
-            filled = False
-            for row in range(self.mapping_table.rowCount()):
-                item = self.mapping_table.item(row, col_index)
-                if item is None or item.text().strip() == "":
-                    if item is None:
-                        new_item = QtWidgets.QTableWidgetItem(obj)
-                        new_item.setFlags(new_item.flags() | QtCore.Qt.ItemIsEditable |
-                                          QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-                        self.mapping_table.setItem(row, col_index, new_item)
-                    else:
-                        item.setText(obj)
-                    filled = True
-                    break
-
-            # If no empty cell was found, create a new row.
-            if not filled:
-                row = self.mapping_table.rowCount()
-                self.mapping_table.insertRow(row)
-                checkbox = QtWidgets.QCheckBox()
-                checkbox.setChecked(False)
-                self.mapping_table.setCellWidget(row, 0, checkbox)
-                if col_index == 1:
-                    source_item = QtWidgets.QTableWidgetItem(obj)
-                    source_item.setFlags(source_item.flags() | QtCore.Qt.ItemIsEditable |
-                                           QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-                    self.mapping_table.setItem(row, 1, source_item)
-                    target_item = QtWidgets.QTableWidgetItem("")
-                    target_item.setFlags(target_item.flags() | QtCore.Qt.ItemIsEditable |
-                                           QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-                    self.mapping_table.setItem(row, 2, target_item)
-                else:
-                    source_item = QtWidgets.QTableWidgetItem("")
-                    source_item.setFlags(source_item.flags() | QtCore.Qt.ItemIsEditable |
-                                           QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-                    self.mapping_table.setItem(row, 1, source_item)
-                    target_item = QtWidgets.QTableWidgetItem(obj)
-                    target_item.setFlags(target_item.flags() | QtCore.Qt.ItemIsEditable |
-                                           QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-                    self.mapping_table.setItem(row, 2, target_item)
-
-
-        # Now, for each found object, try to fill an empty cell in the designated column;
-        # if none is available, create a new row.
-        for obj in all_objects:
-            # Skip if the object already exists in the target column.
-            exists = False
-            for row in range(self.mapping_table.rowCount()):
-                item = self.mapping_table.item(row, col_index)
-                if item and item.text().strip() == obj:
-                    exists = True
-                    break
-            if exists:
+        entries = self.mapping_model.entries()
+        sources = {entry["source_joint"]: row for row, entry in enumerate(entries) if entry["source_joint"]}
+        targets = {entry["target_control"] for entry in entries if entry["target_control"]}
+        new_entries = []
+        low = []
+        for proposal in proposals:
+            row = sources.get(proposal["source_joint"])
+            if proposal["target_control"] in targets or (row is not None and entries[row]["target_control"]):
                 continue
-
-            # Attempt to fill an empty cell in the specified column.
-            filled = False
-            for row in range(self.mapping_table.rowCount()):
-                item = self.mapping_table.item(row, col_index)
-                if item is None or item.text().strip() == "":
-                    if item is None:
-                        new_item = QtWidgets.QTableWidgetItem(obj)
-                        new_item.setFlags(new_item.flags() | QtCore.Qt.ItemIsEditable |
-                                        QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-                        self.mapping_table.setItem(row, col_index, new_item)
-                    else:
-                        item.setText(obj)
-                    filled = True
-                    break
-
-            # If no empty cell was found, create a new row.
-            if not filled:
-                row = self.mapping_table.rowCount()
-                self.mapping_table.insertRow(row)
-                # Create the moveable checkbox in column 0.
-                checkbox = QtWidgets.QCheckBox()
-                checkbox.setChecked(True)
-                self.mapping_table.setCellWidget(row, 0, checkbox)
-                if col_index == 1:
-                    source_item = QtWidgets.QTableWidgetItem(obj)
-                    source_item.setFlags(source_item.flags() | QtCore.Qt.ItemIsEditable |
-                                        QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-                    self.mapping_table.setItem(row, 1, source_item)
-                    # Leave the target cell empty.
-                    target_item = QtWidgets.QTableWidgetItem("")
-                    target_item.setFlags(target_item.flags() | QtCore.Qt.ItemIsEditable |
-                                        QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-                    self.mapping_table.setItem(row, 2, target_item)
-                else:
-                    source_item = QtWidgets.QTableWidgetItem("")
-                    source_item.setFlags(source_item.flags() | QtCore.Qt.ItemIsEditable |
-                                        QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-                    self.mapping_table.setItem(row, 1, source_item)
-                    target_item = QtWidgets.QTableWidgetItem(obj)
-                    target_item.setFlags(target_item.flags() | QtCore.Qt.ItemIsEditable |
-                                        QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-                    self.mapping_table.setItem(row, 2, target_item)
+            targets.add(proposal["target_control"])
+            if row is not None:
+                self.mapping_model.setData(self.mapping_model.index(row, 2), proposal["target_control"])
+                self.mapping_model.set_confidence(row, proposal["confidence"])
+            else:
+                new_entries.append(proposal)
+            if proposal["confidence"] < self.LOW_CONFIDENCE:
+                low.append(f"{proposal['source_joint']} -> {proposal['target_control']} "
+                           f"({proposal['confidence']:.2f})")
+        self.mapping_model.insert_entries(new_entries)
+
+        message = f"{len(new_entries)} pairs added."
+        if low:
+            message += "\n\nCheck these low confidence pairs:\n" + "\n".join(low)
+        QtWidgets.QMessageBox.information(self, "Auto Map", message)
+
+    def load_auto_map_rules(self):
+        """
+        Loads the alias rule set of a rig family used by Auto Map.
+        """
+        file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Load Auto Map Rules", "", "JSON Files (*.json)")
+        if file_path:
+            try:
+                self.auto_map_rules = retargeting_automap.load_rules(file_path)
+            except Exception as e:
+                QtWidgets.QMessageBox.critical(self, "Error", f"Failed to load the rules: {e}")
+        self.raise_()
+        self.activateWindow()
 
     def add_mapping_entry(self):
         """
         Manually adds a new mapping entry (row) to the table.
         """
-        row = self.mapping_table.rowCount()
-        self.mapping_table.insertRow(row)
-        checkbox = QtWidgets.QCheckBox()
-        checkbox.setChecked(True)
-        self.mapping_table.setCellWidget(row, 0, checkbox)
-        source_item = QtWidgets.QTableWidgetItem("")
-        source_item.setFlags(source_item.flags() | QtCore.Qt.ItemIsEditable |
-                               QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-        self.mapping_table.setItem(row, 1, source_item)
-        target_item = QtWidgets.QTableWidgetItem("")
-        target_item.setFlags(target_item.flags() | QtCore.Qt.ItemIsEditable |
-                               QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemIsDropEnabled)
-        self.mapping_table.setItem(row, 2, target_item)
-        self.mapping_table.setCurrentCell(row, 1)
+        row = self.mapping_model.insert_entries([{"source_joint": "", "target_control": "", "move_able": True}])
+        self.mapping_table.setCurrentIndex(self.mapping_model.index(row, 1))
 
     def delete_mapping_entries(self):
         """
         Deletes all rows corresponding to the currently selected cells.
         """
-        rows_to_delete = set()
-        for item in self.mapping_table.selectedItems():
-            rows_to_delete.add(item.row())
-        for row in sorted(rows_to_delete, reverse=True):
-            self.mapping_table.removeRow(row)
+        selected = self.mapping_table.selectionModel().selectedIndexes()
+        self.mapping_model.remove_rows(index.row() for index in selected)
 
     def highlight_selected_objects(self):
         """
         When a cell in the Source Joint or Target Rig Control column is selected,
         highlights the corresponding scene object (if it exists) in Maya.
         """
-        selected_items = self.mapping_table.selectedItems()
-        objects_to_select = []
-        for item in selected_items:
-            if item.column() in (1, 2):
-                obj_name = item.text().strip()
-                if obj_name and cmds.objExists(obj_name):
-                    objects_to_select.append(obj_name)
+        namespaces = {1: self.standardize_namespace(self.joint_namespace_edit.text()),
+                      2: self.standardize_namespace(self.rig_namespace_edit.text())}
+        names = []
+        for index in self.mapping_table.selectionModel().selectedIndexes():
+            if index.column() in namespaces:
+                obj_name = (index.data() or "").strip()
+                if obj_name:
+                    names.append(retarget.get_full_name(obj_name, namespaces[index.column()]))
+        counts = self.name_index.count(names)
+        objects_to_select = [name for name in dict.fromkeys(names) if counts[name]]
         if objects_to_select:
             cmds.select(objects_to_select, replace=True)
         else:
@@ -423,24 +739,139 @@ class RetargetingTool(QtWidgets.QDialog):
         """
         joint_namespace = self.standardize_namespace(self.joint_namespace_edit.text())
         rig_namespace = self.standardize_namespace(self.rig_namespace_edit.text())
-        mappings = []
-        for row in range(self.mapping_table.rowCount()):
-            checkbox = self.mapping_table.cellWidget(row, 0)
-            move_able = checkbox.isChecked() if checkbox else False
-            source_joint = (self.mapping_table.item(row, 1).text() 
-                            if self.mapping_table.item(row, 1) is not None else "")
-            target_control = (self.mapping_table.item(row, 2).text() 
-                              if self.mapping_table.item(row, 2) is not None else "")
-            mappings.append({
-                "source_joint": source_joint,
-                "target_control": target_control,
-                "move_able": move_able
-            })
-        retarget.apply_retargeting(rig_namespace, joint_namespace, mappings, self.config_file_path)
+        mappings = self.mapping_model.entries()
+        characters = self.get_characters()
+        if characters is not None and not characters:
+            QtWidgets.QMessageBox.warning(self, "No Characters", "Add at least one character to retarget.")
+            return
         print("Executing retargeting with:")
         print("Source Namespace:", joint_namespace)
         print("Target Namespace:", rig_namespace)
+        missing = self.find_missing_names(mappings, characters or [(joint_namespace, rig_namespace)])
+        if missing:
+            QtWidgets.QMessageBox.critical(self, "Invalid Mapping",
+                                           "Objects not found in the scene:\n" + "\n".join(missing))
+            return
+        if characters:
+            print("Characters:", characters)
         print("Mappings:", mappings)
+        self.retarget_profiler = retarget.RetargetProfiler()
+        # DG for the whole stream, switching the evaluation manager per step would rebuild its graph every window.
+        self.saved_evaluation = cmds.evaluationManager(query=True, mode=True)[0]
+        if self.saved_evaluation != "off":
+            cmds.evaluationManager(mode="off")
+        self.retarget_steps = retarget.stream_retargeting(rig_namespace, joint_namespace, mappings,
+                                                          self.config_file_path, window=self.BAKE_WINDOW,
+                                                          characters=characters, profiler=self.retarget_profiler)
+        self.retarget_phase = None
+        self.set_running(True)
+        self.progress_label.setText("Preparing constraints...")
+        self.retarget_timer.start()
+
+    def find_missing_names(self, mappings, characters):
+        """
+        Checks every source joint and target control of every character against the scene
+        name index, before anything is baked.
+
+        Returns:
+            list: The missing names with their namespace, in mapping order.
+        """
+        names = []
+        for source_namespace, target_namespace in characters:
+            for mapping in mappings:
+                if mapping.get("source_joint"):
+                    names.append(retarget.get_full_name(mapping["source_joint"], source_namespace))
+                if mapping.get("target_control"):
+                    names.append(retarget.get_full_name(mapping["target_control"], target_namespace))
+        counts = self.name_index.count(names)
+        return [name for name in dict.fromkeys(names) if not counts[name]]
+
+    def set_running(self, running):
+        """
+        Shows the progress bar while a retarget runs and locks every other control.
+        """
+        for child in self.findChildren(QtWidgets.QWidget):
+            if child not in (self.progress_widget, self.progress_bar, self.cancel_button, self.progress_label):
+                child.setEnabled(not running)
+        self.menu_bar.setEnabled(not running)
+        self.progress_widget.setVisible(running)
+        self.progress_bar.setValue(0)
+
+    def step_retargeting(self):
+        """
+        Runs one window of the retarget and updates the progress of its phase.
+
+        Refresh, undo and auto key are only suspended for the step itself: Maya stays usable
+        between steps, and each step is its own undo chunk. The evaluation manager stays on DG
+        from Execute until the retarget ends.
+        """
+        try:
+            with retarget.FastExecution(evaluation=None, profiler=self.retarget_profiler,
+                                        chunk_name='retargetStep'):
+                phase, done, total = next(self.retarget_steps)
+        except StopIteration:
+            self.finish_retargeting("Retarget done")
+            return
+        except retarget.MappingValidationError as e:
+            self.finish_retargeting("")
+            QtWidgets.QMessageBox.critical(self, "Invalid Mapping", str(e))
+            return
+        except Exception as e:
+            # As on cancel, the curves of the finished windows and the checkpoint are removed.
+            self.discard_retargeting()
+            self.finish_retargeting(f"Retarget failed: {e}")
+            raise
+
+        now = time.perf_counter()
+        if phase != self.retarget_phase:
+            self.retarget_phase = phase
+            self.phase_start = now
+            self.phase_done = done
+        self.progress_bar.setMaximum(max(total, 1))
+        self.progress_bar.setValue(done)
+        label = self.PHASE_LABELS.get(phase, phase)
+        elapsed = now - self.phase_start
+        if phase == 'bake' and elapsed > 0 and done > self.phase_done:
+            rate = (done - self.phase_done) / elapsed
+            self.progress_label.setText(f"{label}: {done}/{total} frames, {rate:.0f} fps, "
+                                        f"ETA {(total - done) / rate:.0f}s")
+        else:
+            self.progress_label.setText(f"{label}: {done}/{total}")
+
+    def cancel_retargeting(self):
+        """
+        Stops a running retarget: the constraints are deleted and the curves written so far
+        are discarded, the targets keep their previous animation.
+        """
+        if self.retarget_steps is None:
+            return
+        self.discard_retargeting()
+        self.finish_retargeting("Retarget cancelled")
+
+    def discard_retargeting(self):
+        """
+        Closes the retarget generator, which deletes its constraints, and deletes the curves
+        and checkpoint it left unconnected.
+        """
+        self.retarget_timer.stop()
+        with retarget.FastExecution(evaluation=None, profiler=self.retarget_profiler, chunk_name='retargetCancel'):
+            self.retarget_steps.close()
+            retarget.discard_stream()
+
+    def closeEvent(self, event):
+        self.cancel_retargeting()
+        self.name_index.stop()
+        super(RetargetingTool, self).closeEvent(event)
+
+    def finish_retargeting(self, message):
+        self.retarget_timer.stop()
+        self.retarget_steps = None
+        self.retarget_profiler = None
+        saved_evaluation, self.saved_evaluation = self.saved_evaluation, None
+        if saved_evaluation not in (None, "off"):
+            cmds.evaluationManager(mode=saved_evaluation)
+        self.set_running(False)
+        self.progress_label.setText(message)
 
     def load_json_file(self):
         """
@@ -466,19 +897,7 @@ class RetargetingTool(QtWidgets.QDialog):
         file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save JSON File", "", "JSON Files (*.json)")
         if file_path:
             try:
-                json_data = []
-                for row in range(self.mapping_table.rowCount()):
-                    checkbox = self.mapping_table.cellWidget(row, 0)
-                    move_able = checkbox.isChecked() if checkbox else False
-                    source_joint = (self.mapping_table.item(row, 1).text() 
-                                    if self.mapping_table.item(row, 1) is not None else "")
-                    target_control = (self.mapping_table.item(row, 2).text() 
-                                      if self.mapping_table.item(row, 2) is not None else "")
-                    json_data.append({
-                        "source_joint": source_joint,
-                        "target_control": target_control,
-                        "move_able": move_able
-                    })
+                json_data = self.mapping_model.entries()
                 with open(file_path, "w") as f:
                     json.dump(json_data, f, indent=4)
             except Exception as e: